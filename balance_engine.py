@@ -0,0 +1,113 @@
+import numpy as np
+
+from timestamps import to_epoch, date_to_epoch
+from balance_kernel import DEPOSIT, WITHDRAWAL, run_balance_kernel
+from balance_history import BalanceHistory
+
+
+def deal_arrays(processed_deals):
+    # Columns of process_deals output, computed once and shared by every parameter set
+    count = len(processed_deals)
+    series_size = np.fromiter((deal['Размер серии'] for deal in processed_deals), dtype=np.int64, count=count)
+    max_level = int(series_size.max()) if count else 0
+
+    # drawdown[i, level - 1] is the accumulated loss of deal i's series at that level
+    drawdown = np.zeros((count, max_level), dtype=np.float64)
+    for i, deal in enumerate(processed_deals):
+        for level, value in deal['Уровни просадки'].items():
+            drawdown[i, level - 1] = value
+
+    return {
+        'times': np.fromiter((to_epoch(deal['Время']) for deal in processed_deals), dtype=np.int64, count=count),
+        'series_size': series_size,
+        'profit': np.fromiter((deal['Прибыль'] for deal in processed_deals), dtype=np.float64, count=count),
+        'drawdown': drawdown,
+    }
+
+
+def date_window(times, start_date=None, end_date=None):
+    # Deals are time-sorted, so the [start_date, end_date] filter is a slice
+    start = date_to_epoch(start_date)
+    end = date_to_epoch(end_date)
+    left = 0 if start is None else int(np.searchsorted(times, start, side='left'))
+    right = len(times) if end is None else int(np.searchsorted(times, end, side='right'))
+    return left, max(left, right)
+
+
+def deal_losses(arrays, drawdown_level, left=0, right=None):
+    # Series longer than drawdown_level are cut at that level's loss, the rest keep their own result
+    series_size = arrays['series_size'][left:right]
+    drawdown = arrays['drawdown'][left:right]
+    if 1 <= drawdown_level <= drawdown.shape[1]:
+        level_loss = drawdown[:, drawdown_level - 1]
+    else:
+        level_loss = np.zeros(len(series_size), dtype=np.float64)
+    return np.where(series_size > drawdown_level, level_loss, arrays['profit'][left:right])
+
+
+def series_loss(series, drawdown_level):
+    # deal_losses for one deal_series.Series, used where series arrive one by one (portfolio, watch)
+    if series.size > drawdown_level:
+        return series.levels[drawdown_level - 1] if drawdown_level >= 1 else 0.0
+    return series.profit
+
+
+def recalculate_balance_arrays(arrays, initial_balance, drawdown_level, start_date=None, end_date=None, multiplier=3000, risk_manage=None, profit_mining=None, use_jit=None):
+    left, right = date_window(arrays['times'], start_date, end_date)
+    return recalculate_slice(arrays, left, right, initial_balance, drawdown_level, multiplier, risk_manage, profit_mining, use_jit)
+
+
+def recalculate_slice(arrays, left, right, initial_balance, drawdown_level, multiplier=3000, risk_manage=None, profit_mining=None, use_jit=None, losses=None):
+    # Deals [left, right) of an already resolved window; losses of the whole history for this
+    # drawdown_level may be passed in, so evaluating many windows slices it instead of recomputing
+    losses = deal_losses(arrays, drawdown_level, left, right) if losses is None else losses[left:right]
+
+    # Only the balance recurrence itself stays sequential; it runs compiled when numba is installed
+    result = run_balance_kernel(losses, initial_balance, multiplier, risk_manage, profit_mining, use_jit)
+    result['times'] = arrays['times'][left:right]
+    result['series_size'] = arrays['series_size'][left:right]
+    return result
+
+
+def to_balance_history(result):
+    # Same records as recalculate_balance; events follow the deal that triggered them 5 seconds later
+    return BalanceHistory.from_result(result)
+
+
+def final_balance(result):
+    # Balance after the last record, including a deposit or withdrawal that followed the last deal
+    if not len(result['balance']):
+        return None
+    event_index = result['event_index']
+    if len(event_index) and event_index[-1] == len(result['balance']) - 1:
+        return float(result['event_balance'][-1])
+    return float(result['balance'][-1])
+
+
+def max_drawdown(result, initial_balance):
+    # Peak-to-trough of the balance with deposits and withdrawals taken out, so only trading losses count
+    balance = result['balance']
+    if not len(balance):
+        return 0.0
+    cash_flow = np.zeros(len(balance), dtype=np.float64)
+    np.add.at(cash_flow, result['event_index'], result['event_amount'])
+    flows_before = np.concatenate(([0.0], np.cumsum(cash_flow)[:-1]))
+    equity = np.concatenate(([initial_balance], balance - flows_before))
+    return float(np.max(np.maximum.accumulate(equity) - equity))
+
+
+def summarize_result(result, initial_balance):
+    deposits = result['event_type'] == DEPOSIT
+    withdrawals = result['event_type'] == WITHDRAWAL
+    return {
+        'final_balance': final_balance(result),
+        # count_income truncates every deduction to int, the summary does the same
+        'total_income': float(np.trunc(result['mining']).sum()),
+        'deposits': int(deposits.sum()),
+        'deposited': float(result['event_amount'][deposits].sum()),
+        'withdrawals': int(withdrawals.sum()),
+        # + 0.0 turns the -0.0 of an empty selection into 0.0
+        'withdrawn': -float(result['event_amount'][withdrawals].sum()) + 0.0,
+        'max_drawdown': max_drawdown(result, initial_balance),
+        'deals': len(result['balance']),
+    }
@@ -0,0 +1,147 @@
+from enum import IntEnum
+import numpy as np
+
+from balance_kernel import DEPOSIT, WITHDRAWAL
+
+
+class RecordType(IntEnum):
+    # 'Тип' of a balance history record; codes are the event types of the balance kernel
+    DEAL = 0
+    DEPOSIT = DEPOSIT
+    WITHDRAWAL = WITHDRAWAL
+
+    @property
+    def label(self):
+        return RECORD_LABELS[self]
+
+
+RECORD_LABELS = {
+    RecordType.DEAL: 'сделка',
+    RecordType.DEPOSIT: 'пополнение',
+    RecordType.WITHDRAWAL: 'снятие средств',
+}
+LABEL_TYPES = {label: record_type for record_type, label in RECORD_LABELS.items()}
+
+ITER_BLOCK = 1 << 14
+
+# One record is 45 bytes instead of a dict with seven keys and boxed values (about 0.5 KB)
+HISTORY_DTYPE = np.dtype([
+    ('time', np.int64),
+    ('profit', np.float64),
+    ('balance', np.float64),
+    ('mining', np.float64),
+    ('multiplier', np.int64),
+    ('series_size', np.int32),
+    ('type', np.int8),
+])
+
+# Field of every key of the old record dicts, in their order
+RECORD_FIELDS = {
+    'Время': 'time',
+    'Прибыль': 'profit',
+    'Баланс': 'balance',
+    'Размер серии': 'series_size',
+    'Множитель': 'multiplier',
+    'Тип': 'type',
+    'Сбор дохода': 'mining',
+}
+
+
+def history_columns(result):
+    # recalculate_balance_arrays result -> ordered record columns; events follow their deal 5 seconds later
+    deals = len(result['balance'])
+    events = len(result['event_index'])
+    order = np.lexsort((np.concatenate((np.zeros(deals), np.arange(1, events + 1))),
+                        np.concatenate((np.arange(deals), result['event_index']))))
+
+    times = result['times']
+    return {
+        'time': np.concatenate((times, times[result['event_index']] + 5))[order],
+        'profit': np.concatenate((result['profit'], result['event_amount']))[order],
+        'balance': np.concatenate((result['balance'], result['event_balance']))[order],
+        'series_size': np.concatenate((result['series_size'], np.zeros(events, dtype=np.int64)))[order],
+        'multiplier': np.concatenate((result['multiplier'], np.zeros(events, dtype=np.int64)))[order],
+        'type': np.concatenate((np.zeros(deals, dtype=np.int8), result['event_type']))[order],
+        'mining': np.concatenate((result['mining'], np.zeros(events)))[order],
+    }
+
+
+def record_dict(row):
+    # Structured record as a tuple -> the record dict recalculate_balance used to build
+    time, profit, balance, mining, multiplier, series_size, record_type = row
+    return {
+        'Время': time,
+        'Прибыль': profit,
+        'Баланс': balance,
+        'Размер серии': series_size,
+        'Множитель': multiplier,
+        'Тип': RECORD_LABELS[record_type],
+        'Сбор дохода': mining,
+    }
+
+
+class BalanceHistory:
+    # Balance history as one structured array. Iterating, indexing with an int or to_dicts() gives the
+    # old record dicts on demand; history['balance'] or history['Баланс'] is a column without copying.
+    __slots__ = ('records',)
+
+    def __init__(self, records):
+        self.records = records
+
+    @classmethod
+    def from_columns(cls, columns):
+        records = np.empty(len(columns['time']), dtype=HISTORY_DTYPE)
+        for name in HISTORY_DTYPE.names:
+            records[name] = columns[name]
+        return cls(records)
+
+    @classmethod
+    def from_result(cls, result):
+        return cls.from_columns(history_columns(result))
+
+    @classmethod
+    def from_dicts(cls, records):
+        records = list(records)
+        columns = {field: [record[key] for record in records] for key, field in RECORD_FIELDS.items() if field != 'type'}
+        columns['type'] = [LABEL_TYPES[record['Тип']] for record in records]
+        columns['time'] = [int(value) for value in columns['time']]
+        return cls.from_columns(columns)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.records[RECORD_FIELDS.get(key, key)]
+        if isinstance(key, slice):
+            return BalanceHistory(self.records[key])
+        return self.record(key)
+
+    def record(self, index):
+        return record_dict(self.records[index].tolist())
+
+    def __iter__(self):
+        # Rows are converted in blocks, so iterating never holds more than a block of dicts
+        for start in range(0, len(self.records), ITER_BLOCK):
+            for row in self.records[start:start + ITER_BLOCK].tolist():
+                yield record_dict(row)
+
+    def to_dicts(self):
+        return list(self)
+
+    def __eq__(self, other):
+        if isinstance(other, BalanceHistory):
+            return np.array_equal(self.records, other.records)
+        if isinstance(other, list):
+            return self.to_dicts() == other
+        return NotImplemented
+
+    def __repr__(self):
+        return f'BalanceHistory({len(self)} records)'
+
+    def columns(self):
+        return {name: self.records[name] for name in HISTORY_DTYPE.names}
+
+    @property
+    def nbytes(self):
+        return self.records.nbytes
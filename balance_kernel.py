@@ -0,0 +1,148 @@
+import math
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+from tiers import risk_tiers, mining_tiers
+
+
+HAS_NUMBA = njit is not None
+
+DEPOSIT = 1
+WITHDRAWAL = 2
+
+
+def balance_recurrence(losses, risk_levels, risk_percents, mining_levels, mining_percents, initial_balance, multiplier,
+                       balance, deposits, withdrawals,
+                       balance_out, profit_out, ratio_out, mining_out, event_index, event_type, event_amount, event_balance):
+    # Path-dependent part of recalculate_balance over primitive arrays; fills the *_out buffers
+    # and the event buffers (at most two events per deal) and returns (event_count, deposits, withdrawals).
+    # balance / deposits / withdrawals are the account state before the first loss, so a long
+    # stream can be run chunk by chunk
+    first_deposit = initial_balance
+    event_count = 0
+
+    for i in range(len(losses)):
+        # Tier lookups are inlined binary searches (bisect_right - 1) so the kernel compiles on its own
+        low, high = 0, len(risk_levels)
+        while low < high:
+            middle = (low + high) // 2
+            if balance < risk_levels[middle]:
+                high = middle
+            else:
+                low = middle + 1
+        tier = low - 1
+        if tier < 0:
+            raise ValueError('Balance is below the lowest risk_manage level')
+        risky_balance = balance * (risk_percents[tier] / 100)
+        buffer_balance = balance - risky_balance
+
+        balance_ratio = int(math.floor(risky_balance / multiplier))
+        if balance_ratio < 1:
+            balance_ratio = 1
+        loss = losses[i] * balance_ratio
+
+        last_positive_balance = risky_balance
+        risky_balance += loss
+        balance_change = loss
+        if risky_balance < 0:
+            balance_change = -last_positive_balance
+            risky_balance = 0.0
+
+        balance = risky_balance + buffer_balance
+
+        profit_mining_deduction = 0.0
+        if balance_change > 0:
+            low, high = 0, len(mining_levels)
+            while low < high:
+                middle = (low + high) // 2
+                if balance < mining_levels[middle]:
+                    high = middle
+                else:
+                    low = middle + 1
+            tier = low - 1
+            if tier >= 0:
+                profit_mining_deduction = balance_change * mining_percents[tier] / 100
+                balance_change -= profit_mining_deduction
+                balance -= profit_mining_deduction
+
+        balance_out[i] = balance
+        profit_out[i] = balance_change
+        ratio_out[i] = balance_ratio
+        mining_out[i] = profit_mining_deduction
+
+        if balance < first_deposit:
+            deposit_amount = first_deposit - balance
+            balance += deposit_amount
+            deposits += 1
+            event_index[event_count] = i
+            event_type[event_count] = DEPOSIT
+            event_amount[event_count] = deposit_amount
+            event_balance[event_count] = balance
+            event_count += 1
+
+        if balance >= ((multiplier * 2) + first_deposit) and withdrawals < deposits:
+            balance -= first_deposit
+            withdrawals += 1
+            event_index[event_count] = i
+            event_type[event_count] = WITHDRAWAL
+            event_amount[event_count] = -first_deposit
+            event_balance[event_count] = balance
+            event_count += 1
+
+    return event_count, deposits, withdrawals
+
+
+balance_recurrence_jit = njit(cache=True, nogil=True)(balance_recurrence) if HAS_NUMBA else None
+
+
+def tier_arrays(tiers, default_percent=None):
+    # Sorted thresholds and percents of a compiled TierTable; risk_manage=None means 100% risk at any balance
+    if tiers is None:
+        if default_percent is None:
+            return np.empty(0, dtype=np.float64), np.empty(0, dtype=np.float64)
+        return np.array([-np.inf]), np.array([float(default_percent)])
+    return tiers.levels_array, tiers.percents_array
+
+
+def run_balance_kernel(losses, initial_balance, multiplier, risk_manage=None, profit_mining=None, use_jit=None, state=None):
+    # state: (balance, deposits, withdrawals) carried over from the previous chunk, a fresh account by default
+    balance, deposits, withdrawals = (initial_balance, 1, 0) if state is None else state
+    risk_levels, risk_percents = tier_arrays(risk_tiers(risk_manage), default_percent=100)
+    mining_levels, mining_percents = tier_arrays(mining_tiers(profit_mining))
+    count = len(losses)
+    use_jit = HAS_NUMBA if use_jit is None else use_jit and HAS_NUMBA
+
+    if use_jit:
+        buffers = (np.empty(count, dtype=np.float64), np.empty(count, dtype=np.float64),
+                   np.empty(count, dtype=np.int64), np.empty(count, dtype=np.float64),
+                   np.empty(2 * count, dtype=np.int64), np.empty(2 * count, dtype=np.int8),
+                   np.empty(2 * count, dtype=np.float64), np.empty(2 * count, dtype=np.float64))
+        event_count, deposits, withdrawals = balance_recurrence_jit(
+            np.ascontiguousarray(losses, dtype=np.float64), risk_levels, risk_percents, mining_levels, mining_percents,
+            float(initial_balance), float(multiplier), float(balance), int(deposits), int(withdrawals), *buffers)
+    else:
+        # Plain Python runs much faster on lists than on element access into numpy arrays
+        buffers = ([0.0] * count, [0.0] * count, [0] * count, [0.0] * count,
+                   [0] * (2 * count), [0] * (2 * count), [0.0] * (2 * count), [0.0] * (2 * count))
+        event_count, deposits, withdrawals = balance_recurrence(
+            np.asarray(losses, dtype=np.float64).tolist(), risk_levels.tolist(), risk_percents.tolist(),
+            mining_levels.tolist(), mining_percents.tolist(), float(initial_balance), float(multiplier),
+            float(balance), int(deposits), int(withdrawals), *buffers)
+
+    balance_out, profit_out, ratio_out, mining_out, event_index, event_type, event_amount, event_balance = buffers
+    return {
+        'profit': np.asarray(profit_out, dtype=np.float64),
+        'balance': np.asarray(balance_out, dtype=np.float64),
+        'multiplier': np.asarray(ratio_out, dtype=np.int64),
+        'mining': np.asarray(mining_out, dtype=np.float64),
+        'event_index': np.asarray(event_index[:event_count], dtype=np.int64),
+        'event_type': np.asarray(event_type[:event_count], dtype=np.int8),
+        'event_amount': np.asarray(event_amount[:event_count], dtype=np.float64),
+        'event_balance': np.asarray(event_balance[:event_count], dtype=np.float64),
+        'deposits': deposits,
+        'withdrawals': withdrawals,
+    }
@@ -0,0 +1,107 @@
+import os
+import glob
+import argparse
+from multiprocessing import Pool
+import pandas as pd
+
+from deal_cache import CACHE_DIR, read_deal_columns
+from deal_series import SeriesTable
+from export import export_frame
+from sweep import param_grid, parse_values, load_tiers, evaluate_params
+from main_calculator import RISK_MANAGE, PROFIT_MINING, START_DATE, END_DATE
+
+
+def find_reports(sources):
+    # Directories give their *.html reports, anything else is a file name or a glob pattern
+    reports = []
+    for source in sources:
+        if os.path.isdir(source):
+            reports.extend(sorted(glob.glob(os.path.join(source, '*.html'))))
+        else:
+            reports.extend(sorted(glob.glob(source)) or [source])
+    # The same report given twice (directory and glob) is processed once
+    return list(dict.fromkeys(os.path.abspath(report) for report in reports))
+
+
+def report_label(file_name):
+    return os.path.splitext(os.path.basename(file_name))[0]
+
+
+def process_report(task):
+    # One report in a worker: parse only when its deal cache is missing or stale, then run the whole grid
+    file_name, grid, start_date, end_date, cache_dir = task
+    label = report_label(file_name)
+    try:
+        columns, cached = read_deal_columns(file_name, cache_dir)
+        arrays = SeriesTable.from_columns(columns).arrays()
+    except (OSError, ValueError, KeyError, IndexError) as error:
+        # Unreadable file, bad numbers or a deals table with other columns: this report fails, the batch goes on
+        return {'report': label, 'path': file_name, 'error': f'{type(error).__name__}: {error}'}, []
+
+    rows = [{'report': label, **evaluate_params(arrays, params, start_date, end_date)} for params in grid]
+    status = {'report': label, 'path': file_name, 'cached': cached, 'deals': len(columns), 'series': len(arrays['times'])}
+    return status, rows
+
+
+def run_batch(reports, grid, start_date=START_DATE, end_date=END_DATE, processes=None, cache_dir=CACHE_DIR,
+              objective='final_balance', ascending=False):
+    # Reports are the unit of work: every worker parses (or maps the cache of) one report and sweeps the grid on it
+    tasks = [(report, grid, start_date, end_date, cache_dir) for report in reports]
+    if processes == 1 or len(tasks) <= 1:
+        outputs = [process_report(task) for task in tasks]
+    else:
+        with Pool(min(processes or os.cpu_count(), len(tasks))) as pool:
+            outputs = pool.map(process_report, tasks, chunksize=1)
+
+    statuses = pd.DataFrame([status for status, _ in outputs])
+    table = pd.DataFrame([row for _, rows in outputs for row in rows])
+    if len(table):
+        table = table.sort_values(objective, ascending=ascending, kind='stable').reset_index(drop=True)
+    return table, statuses
+
+
+def best_per_report(table, objective='final_balance', ascending=False):
+    # The best parameter set of every report, reports ordered by it
+    if not len(table):
+        return table
+    ordered = table.sort_values(objective, ascending=ascending, kind='stable')
+    return ordered.drop_duplicates('report').reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Пакетный расчет нескольких отчетов тестера с общей сеткой параметров')
+    parser.add_argument('reports', nargs='+', help='Каталоги, файлы или маски отчетов (files/reports/*.html)')
+    parser.add_argument('--initial-balances', default='500,1000,2000,4000')
+    parser.add_argument('--drawdown-levels', default='8-11')
+    parser.add_argument('--tiers', help='JSON с наборами risk_manage и profit_mining')
+    parser.add_argument('--start-date', default=START_DATE)
+    parser.add_argument('--end-date', default=END_DATE)
+    parser.add_argument('--processes', type=int)
+    parser.add_argument('--objective', default='final_balance')
+    parser.add_argument('--ascending', action='store_true')
+    parser.add_argument('--best', action='store_true', help='Только лучший набор параметров каждого отчета')
+    parser.add_argument('--output', help='Сохранить сводную таблицу (.csv, .parquet, .feather, .xlsx)')
+    args = parser.parse_args()
+
+    reports = find_reports(args.reports)
+    risk_manages, profit_minings = load_tiers(args.tiers) if args.tiers else ({'base': RISK_MANAGE}, {'base': PROFIT_MINING})
+    grid = param_grid(parse_values(args.initial_balances), parse_values(args.drawdown_levels), risk_manages, profit_minings)
+
+    table, statuses = run_batch(reports, grid, args.start_date, args.end_date, args.processes,
+                                objective=args.objective, ascending=args.ascending)
+    if 'error' in statuses:
+        for status in statuses[statuses['error'].notna()].to_dict('records'):
+            print(f"Ошибка {status['path']}: {status['error']}")
+    if 'cached' in statuses:
+        parsed = statuses['cached'].eq(False).sum()
+        print(f'Отчетов: {len(reports)}, разобрано заново: {parsed}, из кэша: {statuses["cached"].eq(True).sum()}')
+
+    if args.best:
+        table = best_per_report(table, args.objective, args.ascending)
+    print(table.to_string())
+    if args.output:
+        export_frame(table, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from deal_cache import load_deal_columns, columns_to_deals
+from main_calculator import process_deals, recalculate_balance
+from balance_engine import deal_arrays, recalculate_balance_arrays, to_balance_history
+from balance_kernel import HAS_NUMBA, run_balance_kernel
+
+
+DEFAULT_REPORT = 'files/reports/ReportTester-GBP_H1.html'
+
+RISK_MANAGE = {0: 100, 15000: 50, 45000: 25, 135000: 12.5, 405000: 6.25}
+PROFIT_MINING = {45000: 10, 135000: 20}
+CALC_PARAMS = [(500, 8), (1000, 9), (2000, 10), (4000, 11)]
+START_DATE = '01.01.2014'
+END_DATE = '01.01.2024'
+
+
+def best_time(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    report_file = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_REPORT
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    processed_deals = process_deals(columns_to_deals(load_deal_columns(report_file)))
+    arrays = deal_arrays(processed_deals)
+    print(f'Отчет: {report_file}, серий: {len(processed_deals)}')
+
+    for initial_balance, drawdown_level in CALC_PARAMS:
+        args = (initial_balance, drawdown_level, START_DATE, END_DATE, initial_balance, RISK_MANAGE, PROFIT_MINING)
+
+        # Regression check: the engine must reproduce recalculate_balance record for record
+        expected = recalculate_balance(processed_deals, *args)
+        actual = to_balance_history(recalculate_balance_arrays(arrays, *args))
+        assert actual == expected, f'engine output differs for {initial_balance}/{drawdown_level}'
+
+        loop_time = best_time(lambda: recalculate_balance(processed_deals, *args), repeat)
+        engine_time = best_time(lambda: recalculate_balance_arrays(arrays, *args), repeat)
+        print(f'{initial_balance:>5}/{drawdown_level:02d}: loop {loop_time * 1000:.2f} ms, '
+              f'engine {engine_time * 1000:.2f} ms, x{loop_time / engine_time:.1f}')
+
+    kernel_throughput()
+
+
+def kernel_throughput(count=1_000_000):
+    # Raw recurrence speed on synthetic series results, compiled vs plain Python
+    rng = np.random.default_rng(0)
+    losses = np.where(rng.random(count) < 0.8, rng.uniform(5, 10, count), -rng.uniform(10, 80, count))
+    modes = [False, True] if HAS_NUMBA else [False]
+    for use_jit in modes:
+        run_balance_kernel(losses[:10], 1000, 1000, RISK_MANAGE, PROFIT_MINING, use_jit)
+        elapsed = best_time(lambda: run_balance_kernel(losses, 1000, 1000, RISK_MANAGE, PROFIT_MINING, use_jit), 3)
+        print(f"kernel {'numba' if use_jit else 'python'}: {count / elapsed / 1e6:.2f} M deals/s")
+
+
+if __name__ == '__main__':
+    main()
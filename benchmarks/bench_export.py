@@ -0,0 +1,54 @@
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from balance_kernel import run_balance_kernel
+from balance_engine import to_balance_history
+from export import history_frame, export_history
+from main_calculator import RISK_MANAGE, PROFIT_MINING
+
+
+def synthetic_result(count, seed=0):
+    # Balance history of `count` synthetic deals, one deal per hour starting 2014.01.01
+    rng = np.random.default_rng(seed)
+    losses = np.where(rng.random(count) < 0.8, rng.uniform(5, 10, count), -rng.uniform(10, 80, count))
+    result = run_balance_kernel(losses, 1000, 1000, RISK_MANAGE, PROFIT_MINING)
+    result['times'] = 1388534400 + np.arange(count, dtype=np.int64) * 3600
+    result['series_size'] = rng.integers(1, 12, count)
+    return result
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    result = synthetic_result(count)
+    print(f'Записей в истории: {len(history_frame(result))}')
+
+    with tempfile.TemporaryDirectory() as directory:
+        def legacy():
+            # Old path: list of dicts -> DataFrame -> df.to_excel
+            pd.DataFrame(to_balance_history(result).to_dicts()).to_excel(os.path.join(directory, 'legacy.xlsx'), index=False, startrow=2)
+
+        baseline = timed(legacy)
+        print(f'{"legacy xlsx":>14}: {baseline:.3f} s')
+        for extension in ['xlsx', 'csv', 'parquet', 'feather']:
+            try:
+                elapsed = timed(lambda: export_history(result, os.path.join(directory, f'history.{extension}')))
+            except ImportError as error:
+                print(f'{extension:>14}: пропущено ({error})')
+                continue
+            print(f'{extension:>14}: {elapsed:.3f} s, x{baseline / elapsed:.1f}')
+
+
+if __name__ == '__main__':
+    main()
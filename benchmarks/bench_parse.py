@@ -0,0 +1,54 @@
+import os
+import sys
+import json
+import time
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from read_reports import parse_html
+from instrumentation import peak_rss_kb
+
+
+DEFAULT_REPORT = 'files/reports/ReportTester-GBP_H1.html'
+
+
+def run_single(report_file, streaming):
+    start = time.perf_counter()
+    deals = parse_html(report_file, streaming=streaming)
+    elapsed = time.perf_counter() - start
+    return {
+        'mode': 'streaming' if streaming else 'bs4',
+        'deals': len(deals),
+        'seconds': elapsed,
+        'peak_rss_kb': peak_rss_kb(),
+    }
+
+
+def run_isolated(report_file, streaming):
+    # Every mode runs in a fresh interpreter, otherwise peak RSS of the first run masks the second
+    args = [sys.executable, os.path.abspath(__file__), '--single', report_file]
+    if streaming:
+        args.append('--streaming')
+    output = subprocess.run(args, check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def main():
+    args = sys.argv[1:]
+    if args and args[0] == '--single':
+        print(json.dumps(run_single(args[1], '--streaming' in args)))
+        return
+
+    report_file = args[0] if args else DEFAULT_REPORT
+    size_kb = os.path.getsize(report_file) // 1024
+    print(f'Отчет: {report_file} ({size_kb} KB)')
+
+    results = [run_isolated(report_file, False), run_isolated(report_file, True)]
+    for result in results:
+        print(f"{result['mode']:>10}: {result['seconds']:.3f} s, peak RSS {result['peak_rss_kb']} KB, deals {result['deals']}")
+    print(f"Ускорение: {results[0]['seconds'] / results[1]['seconds']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
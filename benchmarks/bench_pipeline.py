@@ -0,0 +1,168 @@
+import os
+import gc
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import matplotlib
+
+from synthetic_report import write_report
+from read_reports import parse_html, iter_deals
+from deal_cache import deals_to_columns, build_deal_columns
+from deal_series import SeriesTable
+from balance_engine import recalculate_balance_arrays
+from balance_kernel import HAS_NUMBA
+from export import export_history
+from draw_plots import plot_weekly_balance, plot_weekly_series
+from instrumentation import peak_rss_kb
+from main_calculator import process_deals, recalculate_balance, count_income, save_to_excel, RISK_MANAGE, PROFIT_MINING, START_DATE, END_DATE
+
+
+# Whole pipeline of chek_calculates, stage by stage, on synthetic reports of growing size.
+# Stages that go through lists of dicts are run only up to --legacy-max deals; the report itself is
+# read with build_deal_columns, block by block, so the other stages scale to millions of deals.
+
+XLSX_MAX_ROWS = 1048576 - 3  # sheet limit minus the startrow=2 gap and the header
+
+
+def measure(stage, func, items, memory):
+    # Timed run without tracing; with memory=True a second traced run gives the peak of Python and NumPy allocations
+    gc.collect()
+    start = time.perf_counter()
+    value = func()
+    seconds = time.perf_counter() - start
+    stage.update({'seconds': seconds, 'items': items, 'items_per_second': items / seconds if seconds else None})
+
+    if memory:
+        del value
+        gc.collect()
+        tracemalloc.start()
+        value = func()
+        stage['peak_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+        tracemalloc.stop()
+    stage['peak_rss_kb'] = peak_rss_kb()
+    return value
+
+
+def run_size(deals, directory, args, weights):
+    params = {'initial_balance': args.initial_balance, 'drawdown_level': args.drawdown_level}
+    legacy = deals <= args.legacy_max
+    stages = {}
+
+    def stage(name, func, items, enabled=True, reason=None):
+        if not enabled:
+            stages[name] = {'skipped': reason or f'больше {args.legacy_max} сделок'}
+            return None
+        stages[name] = {}
+        value = measure(stages[name], func, items, args.memory)
+        print(f'{deals:>10} {name:>20}: {stages[name]["seconds"]:9.3f} s', flush=True)
+        return value
+
+    report_file = os.path.join(directory, f'synthetic_{deals}.html')
+    if not os.path.exists(report_file):
+        start = time.perf_counter()
+        write_report(report_file, deals, args.seed, args.loss_probability, args.max_series, weights, years=args.years)
+        print(f'{deals:>10} {"generate":>20}: {time.perf_counter() - start:9.3f} s', flush=True)
+
+    stage('parse_bs4', lambda: parse_html(report_file), deals, legacy)
+    parsed = stage('parse_streaming', lambda: parse_html(report_file, streaming=True), deals, legacy)
+    stage('deal_columns', lambda: deals_to_columns(parsed), deals, legacy)
+    columns = stage('ingest_columns', lambda: build_deal_columns(iter_deals(report_file)), deals)
+
+    processed = stage('process_deals', lambda: process_deals(parsed), deals, legacy)
+    series = stage('series_table', lambda: SeriesTable.from_columns(columns), deals)
+    del parsed
+    arrays = series.arrays()
+    series_count = len(series)
+
+    balance_args = (params['initial_balance'], params['drawdown_level'], START_DATE, END_DATE, params['initial_balance'], RISK_MANAGE, PROFIT_MINING)
+    history = stage('recalculate_balance', lambda: recalculate_balance(processed, *balance_args), series_count, legacy)
+    # Warm-up: the first kernel call compiles or loads the numba cache, which is not part of the stage
+    recalculate_balance_arrays(arrays, *balance_args)
+    result = stage('balance_engine', lambda: recalculate_balance_arrays(arrays, *balance_args), series_count)
+    records = len(result['balance']) + len(result['event_index'])
+
+    stage('count_income_legacy', lambda: count_income(history), records, legacy)
+    stage('count_income', lambda: count_income(result), records)
+    stage('plot_weekly_series', lambda: plot_weekly_series(series, os.path.join(directory, 'series.png')), series_count)
+    stage('plot_weekly_balance', lambda: plot_weekly_balance(result, os.path.join(directory, 'balance.png')), records)
+
+    fits_sheet = records <= XLSX_MAX_ROWS
+    stage('save_to_excel_legacy', lambda: save_to_excel(history, os.path.join(directory, 'legacy.xlsx')), records,
+          legacy and fits_sheet, None if fits_sheet else 'не помещается в лист xlsx')
+    stage('export_xlsx', lambda: export_history(result, os.path.join(directory, 'history.xlsx')), records,
+          fits_sheet, 'не помещается в лист xlsx')
+    stage('export_csv', lambda: export_history(result, os.path.join(directory, 'history.csv')), records)
+
+    return {
+        'deals': deals,
+        'series': series_count,
+        'records': records,
+        'report_kb': os.path.getsize(report_file) // 1024,
+        'params': params,
+        'stages': stages,
+    }
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'matplotlib': matplotlib.__version__,
+        'numba': HAS_NUMBA,
+        'cpus': os.cpu_count(),
+        'commit': commit,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Время и память каждого этапа расчета на синтетических отчетах')
+    parser.add_argument('--sizes', default='10000,100000', help='Количества сделок через запятую, от 10000 до 10000000 (около 1 КБ отчета на сделку)')
+    parser.add_argument('--output', default='benchmarks/results.json', help='JSON с результатами')
+    parser.add_argument('--reports-dir', help='Каталог для отчетов, по умолчанию временный')
+    parser.add_argument('--legacy-max', type=int, default=20000, help='Максимум сделок для этапов на списках словарей')
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help='Не измерять пик памяти (без второго прогона)')
+    parser.add_argument('--initial-balance', type=int, default=1000)
+    parser.add_argument('--drawdown-level', type=int, default=9)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--loss-probability', type=float, default=0.5)
+    parser.add_argument('--max-series', type=int, default=15)
+    parser.add_argument('--series-weights', help='Веса длин серий 0,1,2,... через запятую')
+    parser.add_argument('--years', type=int, default=10)
+    args = parser.parse_args()
+
+    sizes = [int(value) for value in args.sizes.split(',')]
+    weights = [float(value) for value in args.series_weights.split(',')] if args.series_weights else None
+    matplotlib.use('Agg')
+
+    with tempfile.TemporaryDirectory() as temporary:
+        directory = args.reports_dir or temporary
+        os.makedirs(directory, exist_ok=True)
+        runs = [run_size(deals, directory, args, weights) for deals in sizes]
+
+    report = {'environment': environment(), 'generator': {
+        'seed': args.seed, 'loss_probability': args.loss_probability, 'max_series': args.max_series,
+        'series_weights': weights, 'years': args.years,
+    }, 'runs': runs}
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+    print(f'Результаты: {args.output}')
+
+
+if __name__ == '__main__':
+    main()
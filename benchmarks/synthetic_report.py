@@ -0,0 +1,180 @@
+import os
+import sys
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from timestamps import date_to_epoch, format_times
+
+
+HEADERS = ['Время', 'Сделка', 'Символ', 'Тип', 'Направление', 'Объем', 'Цена', 'Ордер', 'Комиссия', 'Своп', 'Прибыль', 'Баланс', 'Комментарий']
+
+REPORT_HEAD = '''<!DOCTYPE html PUBLIC "-//W3C//DTD HTML 4.01 Transitional//EN" "http://www.w3.org/TR/html4/loose.dtd">
+<html>
+  <head>
+    <title>Strategy Tester Report</title>
+    <meta name="generator" content="strategy tester">
+  </head>
+<body>
+<div align="center">
+<table cellspacing="1" cellpadding="3" border="0">
+   <tr align="center">
+      <td colspan="13"><div style="font: 14pt Tahoma"><b>Strategy Tester Report</b><br></div></td>
+   </tr>
+'''
+
+SECTION_HEAD = '''   <tr>
+      <td nowrap style="height: 10px"></td>
+   </tr>
+   <tr align="center">
+      <th colspan="13" style="height: 25px"><div style="font: 10pt Tahoma"><b>{title}</b></div></th>
+   </tr>
+   <tr align="center" bgcolor="#E5F0FC">
+{headers}
+   </tr>
+'''
+
+REPORT_TAIL = '''   <tr>
+      <td nowrap style="height: 10px"></td>
+   </tr>
+</table>
+</div>
+</body>
+</html>'''
+
+CHUNK = 10000
+
+
+def money(values):
+    # '10 000 007.33' like the tester writes it
+    return [f'{value:,.2f}'.replace(',', ' ') for value in values.tolist()]
+
+
+def series_lengths(rng, count, loss_probability, max_series, weights):
+    # Number of losing deals before every winning one: geometric by default, or drawn from explicit weights
+    if weights:
+        weights = np.asarray(weights, dtype=np.float64)
+        return rng.choice(len(weights), size=count, p=weights / weights.sum())
+    return np.minimum(rng.geometric(1 - loss_probability, size=count) - 1, max_series)
+
+
+def deal_chunks(deals, seed, loss_probability, max_series, weights, start_balance, start_date, years, symbol):
+    # Yields arrays for CHUNK closed deals at a time, so the report never has to fit in memory
+    rng = np.random.default_rng(seed)
+    # Deals are spread over `years` whatever their count, like a backtest on a shorter timeframe
+    step = max(years * 365 * 86400 // (2 * deals), 1)
+    balance = start_balance
+    time = date_to_epoch(start_date)
+    pending = np.empty(0, dtype=np.int64)
+    written = 0
+
+    while written < deals:
+        count = min(CHUNK, deals - written)
+        # Series are cut into deals; a series that does not fit into this chunk continues in the next one
+        while len(pending) < count:
+            lengths = series_lengths(rng, CHUNK, loss_probability, max_series, weights)
+            levels = np.concatenate([np.arange(length + 1) for length in lengths.tolist()])
+            pending = np.concatenate((pending, levels))
+        levels, pending = pending[:count], pending[count:]
+        is_win = np.r_[levels[1:] == 0, pending[0] == 0 if len(pending) else True]
+
+        volume = 0.01 * 2.0 ** levels
+        size = volume * 730 * rng.uniform(0.9, 1.1, count)
+        profit = np.round(np.where(is_win, size, -size), 2)
+        balance_after = np.round(balance + np.cumsum(profit), 2)
+        balance = float(balance_after[-1])
+
+        # One position at a time: open and close times alternate and never go back
+        steps = time + np.cumsum(rng.integers(1, 2 * step, 2 * count))
+        open_time, close_time = steps[0::2], steps[1::2]
+        time = int(close_time[-1])
+
+        yield {
+            'number': written,
+            'open_time': open_time,
+            'close_time': close_time,
+            'volume': volume,
+            'profit': profit,
+            'balance_before': np.round(np.r_[balance_after[0] - profit[0], balance_after[:-1]], 2),
+            'balance': balance_after,
+            'symbol': symbol,
+        }
+        written += count
+
+
+def order_rows(chunk):
+    rows = []
+    opened = format_times(chunk['open_time']).tolist()
+    closed = format_times(chunk['close_time']).tolist()
+    for i, volume in enumerate(chunk['volume'].tolist()):
+        number = 2 * (chunk['number'] + i) + 2
+        rows.append(f'   <tr bgcolor="#FFFFFF" align=right><td>{opened[i]}</td><td>{number}</td><td>{chunk["symbol"]}</td><td>buy</td>'
+                    f'<td colspan="2">{volume:.2f} / {volume:.2f}</td><td>0.00000</td><td></td><td></td><td colspan="2">{opened[i]}</td>'
+                    f'<td>filled</td><td>MA Line Martingale MT5</td></tr>\n')
+        rows.append(f'   <tr bgcolor="#F7F7F7" align=right><td>{closed[i]}</td><td>{number + 1}</td><td>{chunk["symbol"]}</td><td>sell</td>'
+                    f'<td colspan="2">{volume:.2f} / {volume:.2f}</td><td>0.00000</td><td></td><td></td><td colspan="2">{closed[i]}</td>'
+                    f'<td>filled</td><td>sl</td></tr>\n')
+    return rows
+
+
+def deal_rows(chunk):
+    rows = []
+    opened = format_times(chunk['open_time']).tolist()
+    closed = format_times(chunk['close_time']).tolist()
+    before = money(chunk['balance_before'])
+    after = money(chunk['balance'])
+    profits = money(chunk['profit'])
+    for i, volume in enumerate(chunk['volume'].tolist()):
+        number = 2 * (chunk['number'] + i) + 2
+        rows.append(f'   <tr bgcolor="#F7F7F7" align=right><td>{opened[i]}</td><td>{number}</td><td>{chunk["symbol"]}</td><td>buy</td><td>in</td>'
+                    f'<td>{volume:.2f}</td><td>1.00000</td><td>{number}</td><td>0.00</td><td>0.00</td><td>0.00</td><td>{before[i]}</td>'
+                    f'<td>MA Line Martingale MT5</td></tr>\n')
+        rows.append(f'   <tr bgcolor="#FFFFFF" align=right><td>{closed[i]}</td><td>{number + 1}</td><td>{chunk["symbol"]}</td><td>sell</td><td>out</td>'
+                    f'<td>{volume:.2f}</td><td>1.00000</td><td>{number + 1}</td><td>0.00</td><td>0.00</td><td>{profits[i]}</td><td>{after[i]}</td>'
+                    f'<td>{"tp" if chunk["profit"][i] > 0 else "sl"}</td></tr>\n')
+    return rows
+
+
+def write_report(file_name, deals, seed=0, loss_probability=0.5, max_series=15, weights=None, with_orders=True,
+                 start_balance=10000000.0, start_date='01.01.2014', years=10, symbol='GBPUSDrfd'):
+    # UTF-16 LE report with BOM and CRLF line ends, same table layout as the MT5 tester export
+    headers = '\n'.join(f'      <td nowrap><b>{header}</b></td>' for header in HEADERS)
+    options = (deals, seed, loss_probability, max_series, weights, start_balance, start_date, years, symbol)
+
+    with open(file_name, 'w', encoding='utf-16-le', newline='\r\n') as file:
+        file.write('\ufeff' + REPORT_HEAD)
+        if with_orders:
+            file.write(SECTION_HEAD.format(title='Ордера', headers=headers))
+            for chunk in deal_chunks(*options):
+                file.write(''.join(order_rows(chunk)))
+
+        file.write(SECTION_HEAD.format(title='Сделки', headers=headers))
+        start_time = format_times([date_to_epoch(start_date)])[0]
+        balance = money(np.array([start_balance]))[0]
+        file.write(f'   <tr bgcolor="#FFFFFF" align=right><td>{start_time}</td><td>1</td><td></td><td>balance</td><td></td><td></td>'
+                   f'<td></td><td></td><td>0.00</td><td>0.00</td><td>{balance}</td><td>{balance}</td><td></td></tr>\n')
+        for chunk in deal_chunks(*options):
+            file.write(''.join(deal_rows(chunk)))
+        file.write(REPORT_TAIL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Синтетический отчет тестера MT5 заданного размера')
+    parser.add_argument('output', help='Путь к HTML отчету')
+    parser.add_argument('--deals', type=int, default=10000, help='Количество закрытых сделок')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--loss-probability', type=float, default=0.5, help='Вероятность убытка, длина серии ~ геометрическая')
+    parser.add_argument('--max-series', type=int, default=15)
+    parser.add_argument('--series-weights', help='Веса длин серий 0,1,2,... через запятую вместо геометрического')
+    parser.add_argument('--years', type=int, default=10, help='Длина истории в годах')
+    parser.add_argument('--no-orders', action='store_true', help='Не писать раздел ордеров')
+    args = parser.parse_args()
+
+    weights = [float(value) for value in args.series_weights.split(',')] if args.series_weights else None
+    write_report(args.output, args.deals, args.seed, args.loss_probability, args.max_series, weights, not args.no_orders,
+                 years=args.years)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+import os
+import json
+import hashlib
+from itertools import islice
+import numpy as np
+
+from read_reports import iter_deals
+from timestamps import parse_times
+
+
+CACHE_DIR = 'files/cache'
+CACHE_VERSION = 1
+DEAL_BLOCK = 1 << 14  # deal dicts alive at once while the columns of a report are built
+
+DEAL_DTYPE = np.dtype([
+    ('time', np.int64),
+    ('volume', np.float64),
+    ('profit', np.float64),
+    ('balance', np.float64),
+])
+
+
+def to_float(value):
+    # Report numbers come as '10 000 007.33'; already converted values pass through
+    if isinstance(value, str):
+        value = value.replace(' ', '')
+        return float(value) if value else 0.0
+    return float(value)
+
+
+def deals_to_columns(deals):
+    # Times are parsed here once for the whole column and stay epoch seconds from then on
+    columns = np.empty(len(deals), dtype=DEAL_DTYPE)
+    columns['time'] = parse_times([deal['Время'] for deal in deals])
+    columns['volume'] = [to_float(deal['Объем']) for deal in deals]
+    columns['profit'] = [to_float(deal['Прибыль']) for deal in deals]
+    columns['balance'] = [to_float(deal['Баланс']) for deal in deals]
+    return columns
+
+
+def build_deal_columns(deals, block_size=DEAL_BLOCK):
+    # deals_to_columns for any iterable (iter_deals generator): blocks of dicts are converted one at a time
+    # into a buffer of doubling capacity, so the whole report never exists as a list of dicts
+    deals = iter(deals)
+    columns = np.empty(block_size, dtype=DEAL_DTYPE)
+    count = 0
+    while True:
+        block = list(islice(deals, block_size))
+        if not block:
+            return columns[:count]
+        if count + len(block) > len(columns):
+            grown = np.empty(max(count + len(block), 2 * len(columns)), dtype=DEAL_DTYPE)
+            grown[:count] = columns[:count]
+            columns = grown
+        columns[count:count + len(block)] = deals_to_columns(block)
+        count += len(block)
+
+
+def columns_to_deals(columns):
+    # Deal dicts with numeric fields, accepted by process_deals in place of parse_html output
+    return [
+        {'Время': time, 'Объем': volume, 'Прибыль': profit, 'Баланс': balance}
+        for time, volume, profit, balance in columns.tolist()
+    ]
+
+
+def file_hash(file_name):
+    digest = hashlib.sha1()
+    with open(file_name, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_paths(file_name, cache_dir):
+    key = hashlib.sha1(os.path.abspath(file_name).encode('utf-8')).hexdigest()[:16]
+    base = os.path.join(cache_dir, f'{os.path.splitext(os.path.basename(file_name))[0]}_{key}')
+    return base + '.npy', base + '.json'
+
+
+def read_meta(meta_file):
+    try:
+        with open(meta_file, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_atomic(path, write):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        write(file)
+    os.replace(tmp_path, path)
+
+
+def is_cache_valid(file_name, meta, stat):
+    if meta is None or meta.get('version') != CACHE_VERSION:
+        return False
+    if meta['size'] == stat.st_size and meta['mtime_ns'] == stat.st_mtime_ns:
+        return True
+    # Size or mtime changed (copied or touched report) - the content hash decides
+    return meta['size'] == stat.st_size and meta['sha1'] == file_hash(file_name)
+
+
+def save_deal_columns(file_name, columns, cache_dir=CACHE_DIR):
+    os.makedirs(cache_dir, exist_ok=True)
+    data_file, meta_file = cache_paths(file_name, cache_dir)
+    stat = os.stat(file_name)
+    meta = {
+        'version': CACHE_VERSION,
+        'path': os.path.abspath(file_name),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha1': file_hash(file_name),
+        'deals': len(columns),
+    }
+    write_atomic(data_file, lambda file: np.save(file, columns))
+    write_atomic(meta_file, lambda file: file.write(json.dumps(meta, ensure_ascii=False, indent=2).encode('utf-8')))
+
+
+def load_deal_columns(file_name, cache_dir=CACHE_DIR):
+    # Parsed deals as a memory-mapped typed array; the report is parsed only when the cache is missing or stale
+    return read_deal_columns(file_name, cache_dir)[0]
+
+
+def read_deal_columns(file_name, cache_dir=CACHE_DIR):
+    # load_deal_columns that also tells whether the cache was used: (columns, cached)
+    data_file, meta_file = cache_paths(file_name, cache_dir)
+    stat = os.stat(file_name)
+    meta = read_meta(meta_file)
+
+    if os.path.exists(data_file) and is_cache_valid(file_name, meta, stat):
+        if meta['mtime_ns'] != stat.st_mtime_ns:
+            meta['mtime_ns'] = stat.st_mtime_ns
+            write_atomic(meta_file, lambda file: file.write(json.dumps(meta, ensure_ascii=False, indent=2).encode('utf-8')))
+        return np.load(data_file, mmap_mode='r'), True
+
+    columns = build_deal_columns(iter_deals(file_name))
+    save_deal_columns(file_name, columns, cache_dir)
+    return np.load(data_file, mmap_mode='r'), False
@@ -0,0 +1,216 @@
+import numpy as np
+
+from deal_cache import to_float
+from timestamps import to_epoch
+
+
+class Series:
+    # One closed series: the deal that closed it plus the accumulated loss at every level
+    __slots__ = ('time', 'volume', 'balance', 'profit', 'drawdown', 'size', 'levels')
+
+    def __init__(self, time, volume, balance, profit, drawdown, size, levels):
+        self.time = time
+        self.volume = volume
+        self.balance = balance
+        self.profit = profit
+        self.drawdown = drawdown
+        self.size = size
+        self.levels = levels
+
+    def to_dict(self):
+        # Same layout as a process_deals record
+        return {
+            'Время': self.time,
+            'Объем': self.volume,
+            'Баланс': self.balance,
+            'Прибыль': self.profit,
+            'Просадка': self.drawdown,
+            'Размер серии': self.size,
+            'Уровни просадки': {level: value for level, value in enumerate(self.levels, 1)},
+        }
+
+
+class SeriesState:
+    # Everything process_deals keeps between deals, so processing can resume on new deals
+    __slots__ = ('skip_first', 'drawdown', 'series_length', 'levels', 'series_start_balance')
+
+    def __init__(self):
+        self.skip_first = True  # the first report row is the initial balance, not a deal
+        self.drawdown = 0
+        self.series_length = 0
+        self.levels = []
+        self.series_start_balance = None
+
+
+def iter_series(rows, state=None):
+    # Single pass over (time, volume, profit, balance) rows with the same rules as process_deals;
+    # the input is never modified and only the open series is kept in memory
+    state = SeriesState() if state is None else state
+
+    for time, volume, profit, balance in rows:
+        if state.skip_first:
+            state.skip_first = False
+            continue
+
+        if state.series_start_balance is None or state.drawdown == 0:
+            state.series_start_balance = balance - profit
+
+        balance_change = balance - state.series_start_balance
+
+        if profit > 0:
+            if state.drawdown < 0:
+                yield Series(time, volume, balance, balance_change, state.drawdown, state.series_length + 1, tuple(state.levels))
+                state.drawdown = 0
+                state.series_length = 0
+                state.levels = []
+            else:
+                yield Series(time, volume, balance, balance_change, 0, 1, ())
+        else:
+            state.drawdown += profit
+            state.series_length += 1
+            state.levels.append(state.drawdown)
+
+
+def deal_rows(deals):
+    # parse_html / columns_to_deals dicts -> (time, volume, profit, balance)
+    for deal in deals:
+        yield to_epoch(deal['Время']), to_float(deal['Объем']), to_float(deal['Прибыль']), to_float(deal['Баланс'])
+
+
+class GrowingArray:
+    # Append-only column: the buffer doubles when full, so appending n values costs amortized O(n)
+    # whatever the length of the history; values is a view of the filled part
+    __slots__ = ('buffer', 'size')
+
+    def __init__(self, dtype, capacity=1024):
+        self.buffer = np.empty(capacity, dtype=dtype)
+        self.size = 0
+
+    def append(self, values):
+        values = np.asarray(values, dtype=self.buffer.dtype)
+        end = self.size + len(values)
+        if end > len(self.buffer):
+            grown = np.empty(max(end, 2 * len(self.buffer)), dtype=self.buffer.dtype)
+            grown[:self.size] = self.buffer[:self.size]
+            self.buffer = grown
+        self.buffer[self.size:end] = values
+        self.size = end
+
+    @property
+    def values(self):
+        return self.buffer[:self.size]
+
+
+def column_property(name):
+    return property(lambda table: table.columns[name].values)
+
+
+class SeriesTable:
+    # Columnar process_deals result; drawdown levels of all series live in one flat
+    # level_values array, series i owns level_values[level_offsets[i]:level_offsets[i + 1]]
+    COLUMNS = (
+        ('times', np.int64),
+        ('volume', np.float64),
+        ('balance', np.float64),
+        ('profit', np.float64),
+        ('drawdown', np.float64),
+        ('series_size', np.int64),
+        ('level_values', np.float64),
+    )
+
+    times = column_property('times')
+    volume = column_property('volume')
+    balance = column_property('balance')
+    profit = column_property('profit')
+    drawdown = column_property('drawdown')
+    series_size = column_property('series_size')
+    level_values = column_property('level_values')
+    level_offsets = column_property('level_offsets')
+
+    def __init__(self):
+        self.state = SeriesState()
+        self.columns = {name: GrowingArray(dtype) for name, dtype in self.COLUMNS}
+        self.columns['level_offsets'] = GrowingArray(np.int64)
+        self.columns['level_offsets'].append([0])
+
+    @classmethod
+    def from_columns(cls, columns):
+        table = cls()
+        table.extend_columns(columns)
+        return table
+
+    @classmethod
+    def from_deals(cls, deals):
+        table = cls()
+        table.extend(deals)
+        return table
+
+    def __len__(self):
+        return self.columns['times'].size
+
+    def extend_rows(self, rows):
+        # Only the new rows are processed; the open series carries over in self.state and
+        # the columns grow in place, so appending a few deals does not copy the history
+        times, volume, balance, profit, drawdown, series_size, level_counts, level_values = [], [], [], [], [], [], [], []
+        for series in iter_series(rows, self.state):
+            times.append(series.time)
+            volume.append(series.volume)
+            balance.append(series.balance)
+            profit.append(series.profit)
+            drawdown.append(series.drawdown)
+            series_size.append(series.size)
+            level_counts.append(len(series.levels))
+            level_values.extend(series.levels)
+
+        if not times:
+            return 0
+        columns = self.columns
+        columns['times'].append(times)
+        columns['volume'].append(volume)
+        columns['balance'].append(balance)
+        columns['profit'].append(profit)
+        columns['drawdown'].append(drawdown)
+        columns['series_size'].append(series_size)
+        columns['level_offsets'].append(self.level_offsets[-1] + np.cumsum(level_counts, dtype=np.int64))
+        columns['level_values'].append(level_values)
+        return len(times)
+
+    def extend(self, deals):
+        return self.extend_rows(deal_rows(deals))
+
+    def extend_columns(self, columns):
+        # DEAL_DTYPE array from deal_cache, field order matches the row tuples
+        return self.extend_rows(columns[['time', 'volume', 'profit', 'balance']].tolist())
+
+    def levels(self, index):
+        return self.level_values[self.level_offsets[index]:self.level_offsets[index + 1]]
+
+    def record(self, index):
+        return Series(int(self.times[index]), float(self.volume[index]), float(self.balance[index]), float(self.profit[index]),
+                      float(self.drawdown[index]), int(self.series_size[index]), tuple(self.levels(index).tolist()))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.record(index)
+
+    def to_dicts(self):
+        return [series.to_dict() for series in self]
+
+    def drawdown_matrix(self):
+        # Dense [series, level - 1] matrix built from the flat levels without a Python loop
+        counts = np.diff(self.level_offsets)
+        max_level = int(self.series_size.max()) if len(self) else 0
+        matrix = np.zeros((len(self), max_level), dtype=np.float64)
+        rows = np.repeat(np.arange(len(self)), counts)
+        columns = np.arange(len(self.level_values)) - np.repeat(self.level_offsets[:-1], counts)
+        matrix[rows, columns] = self.level_values
+        return matrix
+
+    def arrays(self):
+        # Input columns of balance_engine.recalculate_balance_arrays
+        return {
+            'times': self.times,
+            'series_size': self.series_size,
+            'profit': self.profit,
+            'drawdown': self.drawdown_matrix(),
+        }
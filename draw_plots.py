@@ -1,135 +1,168 @@
-import matplotlib.pyplot as plt
-from datetime import datetime, timedelta
+import os
+from multiprocessing import Pool
 import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import PolyCollection
+
+from balance_kernel import DEPOSIT, WITHDRAWAL
+from balance_history import BalanceHistory, history_columns
+from timestamps import to_epoch
+
+
+# Figures are built with the object API on an Agg canvas: nothing is registered in pyplot,
+# so a figure is freed as soon as it is saved, whatever the number of parameter sets.
+
+WEEK = 7 * 86400
+MONTH_NAMES = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+TYPE_CODES = {'сделка': 0, 'пополнение': DEPOSIT, 'снятие средств': WITHDRAWAL}
+
+# Upper bounds that keep rendering time and memory flat on long histories
+BALANCE_MAX_WIDTH = 400  # inches at dpi=15
+SERIES_MAX_WIDTH = 200  # inches at dpi=100
+SERIES_LABEL_LIMIT = 2000  # bar labels are drawn only up to this many bars
+
+
+def balance_columns(data):
+    # Engine result, BalanceHistory or a list of record dicts -> time, balance, type code, profit arrays
+    if isinstance(data, (dict, BalanceHistory)):
+        columns = data.columns() if isinstance(data, BalanceHistory) else history_columns(data)
+        return columns['time'], columns['balance'], columns['type'], columns['profit']
+    count = len(data)
+    times = np.fromiter((to_epoch(deal['Время']) for deal in data), dtype=np.int64, count=count)
+    balances = np.fromiter((deal['Баланс'] for deal in data), dtype=np.float64, count=count)
+    types = np.fromiter((TYPE_CODES[deal['Тип']] for deal in data), dtype=np.int8, count=count)
+    profits = np.fromiter((deal.get('Прибыль', 0) for deal in data), dtype=np.float64, count=count)
+    return times, balances, types, profits
+
+
+def series_columns(data):
+    # SeriesTable, balance_engine arrays or process_deals dicts -> time and series size arrays
+    if hasattr(data, 'series_size') and hasattr(data, 'times'):
+        return data.times, data.series_size
+    if isinstance(data, dict):
+        return data['times'], data['series_size']
+    count = len(data)
+    times = np.fromiter((to_epoch(deal['Время']) for deal in data), dtype=np.int64, count=count)
+    sizes = np.fromiter((deal['Размер серии'] for deal in data), dtype=np.int64, count=count)
+    return times, sizes
+
+
+def calendar_changes(base_time, weeks):
+    # Weeks where base_date + week * 7 days falls into a new month / year
+    week_times = (base_time + np.arange(weeks, dtype=np.int64) * WEEK).astype('datetime64[s]')
+    months = week_times.astype('datetime64[M]').astype(np.int64)
+    month_changes = np.flatnonzero(np.diff(months) != 0) + 1
+    year_changes = np.flatnonzero(np.diff(months // 12) != 0) + 1
+    return months, month_changes, year_changes
+
+
+def weekly_balance(times, balances, types, profits):
+    # Last balance of every week (carried over empty weeks) and weekly deposit/withdrawal sums
+    week = (times - times[0]) // WEEK
+    weeks = int(week[-1]) + 1
+
+    last = np.flatnonzero(np.r_[week[1:] != week[:-1], True])
+    has_balance = np.zeros(weeks, dtype=bool)
+    has_balance[week[last]] = True
+    finals = np.zeros(weeks)
+    finals[week[last]] = balances[last]
+    finals = finals[np.maximum.accumulate(np.where(has_balance, np.arange(weeks), 0))]
+
+    deposit = types == DEPOSIT
+    withdrawal = types == WITHDRAWAL
+    return {
+        'base_time': int(times[0]),
+        'first_deposit': int(balances[0]) - int(profits[0]),
+        'finals': finals,
+        'deposit_weeks': np.unique(week[deposit]),
+        'deposits': np.bincount(week[deposit], weights=balances[deposit], minlength=weeks),
+        'withdrawal_weeks': np.unique(week[withdrawal]),
+        'withdrawals': np.bincount(week[withdrawal], weights=profits[withdrawal], minlength=weeks),
+    }
+
+
+def bar_collection(x, heights, widths, colors, align='center'):
+    # One PolyCollection instead of a Rectangle artist per bar
+    left = x - widths / 2 if align == 'center' else x
+    right = left + widths
+    zeros = np.zeros(len(x))
+    verts = np.stack([np.column_stack(pair) for pair in ((left, zeros), (left, heights), (right, heights), (right, zeros))], axis=1)
+    return PolyCollection(verts, facecolors=colors, edgecolors='none')
+
+
+def new_figure(**kwargs):
+    figure = Figure(**kwargs)
+    FigureCanvasAgg(figure)
+    return figure
 
 
 def plot_weekly_series(processed_deals, output_file):
-    # Convert times to datetime objects
-    times = [datetime.strptime(deal['Время'], '%Y.%m.%d %H:%M:%S') for deal in processed_deals]
-
-    # Use the date of the first deal as the base date
-    base_date = times[0]
-    end_date = times[-1]
-
-    # Create a list of weeks (since the base date) and series sizes
-    weeks = [(time - base_date).days // 7 for time in times]
-    series_sizes = [deal['Размер серии'] for deal in processed_deals]
-
-    # Group series sizes by week
-    week_to_series_sizes = {}
-    for week, series_size in zip(weeks, series_sizes):
-        if week not in week_to_series_sizes:
-            week_to_series_sizes[week] = []
-        week_to_series_sizes[week].append(series_size)
-
-    # Create a list of all weeks between the first and last deal
-    all_weeks = list(range((end_date - base_date).days // 7 + 1))
-
-    # Prepare the data for the plot
-    x = []
-    widths = []
-    heights = []
-    colors = []
-
-    for week in all_weeks:
-        series_sizes = week_to_series_sizes.get(week, [0])
-
-        num_series = len(series_sizes)
-        for i, series_size in enumerate(series_sizes):
-            x.append(week + i / num_series)
-            widths.append(1.0 / num_series)
-            heights.append(series_size)
-            colors.append('blue' if num_series > 1 else 'darkblue')
-
-    # Create the plot
-    fig, ax = plt.subplots(figsize=(len(x) / 2, 6))
-    bars = ax.bar(x, heights, width=widths, color=colors, align='edge')
-
-    # Add labels under each bar
-    for bar, height in zip(bars, heights):
-        ax.text(bar.get_x() + bar.get_width() / 2.0, -0.05, str(height), color='black', ha='center', va='top')
-
-    # Add labels and title
-    plt.title('Weekly Series Sizes')
-    plt.xlabel('Week')
-    plt.ylabel('Series Size')
-
-    # Set up the space between bars
-    ax.set_xticks([week + 1 for week in all_weeks], minor=True)
-
-    # Add grey lines for weeks
-    for week in all_weeks:
-        ax.axvline(x=week + 1, color='grey', linewidth=0.5, linestyle='--')
-
-    # Determine the weeks when a new month or year starts
-    month_changes = []
-    year_changes = []
-    current_month = base_date.month
-    current_year = base_date.year
-    week_times = [base_date + timedelta(weeks=week) for week in all_weeks]
-
-    for week, time in enumerate(week_times):
-        if time.month != current_month:
-            month_changes.append(week)
-            current_month = time.month
-        if time.year != current_year:
-            year_changes.append(week)
-            current_year = time.year
-
-    # Add vertical lines for month and year changes
-    for week in month_changes:
-        ax.axvline(x=week, color='orange', linestyle='--', linewidth=1)
-    for week in year_changes:
-        ax.axvline(x=week, color='red', linestyle='--', linewidth=2)
-
-    # Add year labels at year changes
-    for week in year_changes:
-        ax.text(week, max(heights) * 1.1, str(week_times[week].year), ha='center', va='top', color='red', fontsize=12)
-
-    # Save the plot as a PNG file
-    plt.savefig(output_file, dpi=100)
+    times, sizes = series_columns(processed_deals)
+    times = np.asarray(times, dtype=np.int64)
+    sizes = np.asarray(sizes)
+
+    # Week of every series and its position among the series of that week
+    week = (times - times[0]) // WEEK
+    weeks = int(week[-1]) + 1
+    per_week = np.bincount(week, minlength=weeks)
+    first_in_week = np.concatenate(([0], np.cumsum(per_week)[:-1]))
+    rank = np.arange(len(week)) - first_in_week[week]
+
+    # Weeks without series get one empty bar, like before
+    empty = np.flatnonzero(per_week == 0)
+    x = np.concatenate((week + rank / per_week[week], empty))
+    widths = np.concatenate((1.0 / per_week[week], np.ones(len(empty))))
+    heights = np.concatenate((sizes, np.zeros(len(empty), dtype=sizes.dtype)))
+    colors = np.where(np.concatenate((per_week[week], np.ones(len(empty)))) > 1, 'blue', 'darkblue')
+    order = np.argsort(x, kind='stable')
+    x, widths, heights, colors = x[order], widths[order], heights[order], colors[order]
+
+    figure = new_figure(figsize=(min(len(x) / 2, SERIES_MAX_WIDTH), 6))
+    ax = figure.subplots()
+    ax.add_collection(bar_collection(x, heights, widths, colors, align='edge'))
+    ax.autoscale_view()
+
+    # Add labels under each bar while their number stays readable
+    if len(x) <= SERIES_LABEL_LIMIT:
+        for left, width, height in zip(x.tolist(), widths.tolist(), heights.tolist()):
+            ax.text(left + width / 2.0, -0.05, str(height), color='black', ha='center', va='top')
+
+    ax.set_title('Weekly Series Sizes')
+    ax.set_xlabel('Week')
+    ax.set_ylabel('Series Size')
+    ax.set_xticks(np.arange(weeks) + 1, minor=True)
+
+    # Week, month and year separators, one LineCollection each
+    _, month_changes, year_changes = calendar_changes(times[0], weeks)
+    axis = ax.get_xaxis_transform()
+    ax.vlines(np.arange(weeks) + 1, 0, 1, transform=axis, colors='grey', linewidth=0.5, linestyles='--')
+    ax.vlines(month_changes, 0, 1, transform=axis, colors='orange', linestyles='--', linewidth=1)
+    ax.vlines(year_changes, 0, 1, transform=axis, colors='red', linestyles='--', linewidth=2)
+
+    year_of_week = (times[0] + year_changes * WEEK).astype('datetime64[s]').astype('datetime64[Y]').astype(np.int64) + 1970
+    for week_number, year in zip(year_changes.tolist(), year_of_week.tolist()):
+        ax.text(week_number, heights.max() * 1.1, str(year), ha='center', va='top', color='red', fontsize=12)
+
+    figure.savefig(output_file, dpi=100)
+    figure.clear()
 
 
 def plot_weekly_balance(processed_deals, output_file):
-    # Convert times to datetime objects and get balances
-    times = [datetime.strptime(deal['Время'], '%Y.%m.%d %H:%M:%S') for deal in processed_deals]
-    balances = [deal['Баланс'] for deal in processed_deals]
-    types = [deal['Тип'] for deal in processed_deals]
-    profits = [deal['Прибыль'] if 'Прибыль' in deal else 0 for deal in processed_deals]
-
-    # Use the date of the first deal as the base date
-    base_date = times[0]
-    end_date = times[-1]
-
-    # Create a list of all weeks between the first and last deal
-    all_weeks = list(range((end_date - base_date).days // 7 + 1))
-
-    # Group balances by week
-    week_to_balances = {week: [] for week in all_weeks}
-    week_to_deposits = {week: [] for week in all_weeks}
-    week_to_withdrawals = {week: [] for week in all_weeks}
-    for time, balance, ttype, profit in zip(times, balances, types, profits):
-        week = (time - base_date).days // 7
-        week_to_balances[week].append(balance)
-        if ttype == 'пополнение':
-            week_to_deposits[week].append(balance)
-        elif ttype == 'снятие средств':
-            week_to_withdrawals[week].append(profit)
-
-    # Get the last balance for each week
-    last_known_balance = None
-    week_finals = {}
-    for week, balances in week_to_balances.items():
-        if balances:
-            last_known_balance = balances[-1]
-        week_finals[week] = last_known_balance
-
-    # Create the plot
-    fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(len(all_weeks) / 2, 30), gridspec_kw={'height_ratios': [8, 1]})
-    # Adjust the subplots size
-    plt.subplots_adjust(left=0.05, right=0.95, top=0.9, bottom=0.1)
-
-    ax1.plot(all_weeks, [week_finals[week] for week in all_weeks], linewidth=12)
+    draw_weekly_balance(weekly_balance(*balance_columns(processed_deals)), output_file)
+
+
+def draw_weekly_balance(weekly, output_file):
+    # Draws from weekly aggregates only, so a live session can redraw without the whole history
+    finals = weekly['finals']
+    weeks = len(finals)
+    top = finals.max()
+
+    figure = new_figure(figsize=(min(weeks / 2, BALANCE_MAX_WIDTH), 30))
+    ax1, ax2 = figure.subplots(2, 1, gridspec_kw={'height_ratios': [8, 1]})
+    figure.subplots_adjust(left=0.05, right=0.95, top=0.9, bottom=0.1)
+
+    ax1.plot(np.arange(weeks), finals, linewidth=12)
 
     ax1.title.set_fontsize(48)
     ax1.xaxis.label.set_fontsize(48)
@@ -141,68 +174,73 @@ def plot_weekly_balance(processed_deals, output_file):
     ax2.yaxis.label.set_fontsize(8)
     ax2.tick_params(axis='x', labelsize=8)
 
-    # Add labels and title
     ax1.set_title('Weekly Final Balance')
     ax1.set_xlabel('Week')
     ax1.set_ylabel('Final Balance')
 
-    # Determine the weeks when a new month or year starts
-    month_changes = []
-    year_changes = []
-    current_month = base_date.month
-    current_year = base_date.year
-    week_times = [base_date + timedelta(weeks=week) for week in all_weeks]
-
-    for week, time in enumerate(week_times):
-        if time.month != current_month:
-            month_changes.append(week)
-            current_month = time.month
-        if time.year != current_year:
-            year_changes.append(week)
-            current_year = time.year
-
-    # Add vertical lines for month and year changes
-    for week in month_changes:
-        ax1.axvline(x=week, color='orange', linestyle='--', linewidth=2)
-        ax2.axvline(x=week, color='orange', linestyle='--', linewidth=2)
-    for week in year_changes:
-        ax1.axvline(x=week, color='red', linestyle='--', linewidth=4)
-        ax2.axvline(x=week, color='red', linestyle='--', linewidth=4)
-
-    # Add year labels at year changes
-    for week in year_changes:
-        ax1.text(week, max(value for value in week_finals.values() if value is not None) * 1.05, str(week_times[week].year), ha='center', va='top', color='red', fontsize=48)
-        ax2.text(week, max(value for value in week_finals.values() if value is not None) * 1.05, str(week_times[week].year), ha='center', va='top', color='red', fontsize=48)
-
-    # Add month labels at month changes
-    month_names = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-    for i in range(len(month_changes)):
-        week = month_changes[i]
-        next_week = month_changes[i + 1] if i + 1 < len(month_changes) else len(all_weeks)
-        label_x = (week + next_week) / 2
-        label_y = ax1.get_ylim()[0] - 700
-        ax1.text(label_x, label_y, month_names[week_times[week].month - 1], ha='center', va='bottom', color='orange', fontsize=36)
-
-    # Create the histogram for deposit and withdrawal
-    deposits = {week: sum(balances) for week, balances in week_to_deposits.items() if balances}
-    withdrawals = {week: sum(balances) for week, balances in week_to_withdrawals.items() if balances}
-    ax2.bar(deposits.keys(), deposits.values(), color='red')
-    ax2.bar(withdrawals.keys(), withdrawals.values(), color='green')
-    for week, value in deposits.items():
-        ax2.text(week, value, f'{value:.2f}', ha='center', va='bottom', fontsize=48)
-    for week, value in withdrawals.items():
-        ax2.text(week, value, f'{-value:.2f}', ha='center', va='top', fontsize=48)
+    # Month and year separators as one LineCollection per kind and axis
+    months, month_changes, year_changes = calendar_changes(weekly['base_time'], weeks)
+    for ax in (ax1, ax2):
+        axis = ax.get_xaxis_transform()
+        ax.vlines(month_changes, 0, 1, transform=axis, colors='orange', linestyles='--', linewidth=2)
+        ax.vlines(year_changes, 0, 1, transform=axis, colors='red', linestyles='--', linewidth=4)
+
+    for week_number in year_changes.tolist():
+        year = str(months[week_number] // 12 + 1970)
+        ax1.text(week_number, top * 1.05, year, ha='center', va='top', color='red', fontsize=48)
+        ax2.text(week_number, top * 1.05, year, ha='center', va='top', color='red', fontsize=48)
+
+    # Month names are minor tick labels centred between month changes instead of separate texts
+    if len(month_changes):
+        label_x = (month_changes + np.r_[month_changes[1:], weeks]) / 2
+        ax1.set_xticks(label_x, [MONTH_NAMES[month % 12] for month in months[month_changes].tolist()], minor=True)
+        ax1.tick_params(axis='x', which='minor', length=0, labelsize=36, labelcolor='orange')
+
+    # Deposit and withdrawal histogram
+    deposit_weeks = weekly['deposit_weeks']
+    withdrawal_weeks = weekly['withdrawal_weeks']
+    deposits = weekly['deposits'][deposit_weeks]
+    withdrawals = weekly['withdrawals'][withdrawal_weeks]
+    ax2.add_collection(bar_collection(deposit_weeks.astype(float), deposits, np.full(len(deposits), 0.8), 'red'))
+    ax2.add_collection(bar_collection(withdrawal_weeks.astype(float), withdrawals, np.full(len(withdrawals), 0.8), 'green'))
+    ax2.autoscale_view()
+    for week_number, value in zip(deposit_weeks.tolist(), deposits.tolist()):
+        ax2.text(week_number, value, f'{value:.2f}', ha='center', va='bottom', fontsize=48)
+    for week_number, value in zip(withdrawal_weeks.tolist(), withdrawals.tolist()):
+        ax2.text(week_number, value, f'{-value:.2f}', ha='center', va='top', fontsize=48)
 
     # Add total deposit and withdrawal amounts to the plot
-    if deposits.values():
-        total_deposit = sum(deposits.values()) + list(deposits.values())[0]
+    if len(deposits):
+        total_deposit = deposits.sum() + deposits[0]
     else:
-        total_deposit = int(processed_deals[0]['Баланс']) - int(processed_deals[0]['Прибыль'])
-    total_withdrawal = sum(withdrawals.values())
-    ax1.text(0, max(value for value in week_finals.values() if value is not None) * 1.1, f'Total deposit adds: {total_deposit:.2f}', ha='left', va='top', color='red', fontsize=96)
-    ax1.text(0, max(value for value in week_finals.values() if value is not None) * 1.0, f'Total withdrawal: {-total_withdrawal:.2f}', ha='left', va='top', color='green', fontsize=96)
+        total_deposit = weekly['first_deposit']
+    total_withdrawal = withdrawals.sum()
+    ax1.text(0, top * 1.1, f'Total deposit adds: {total_deposit:.2f}', ha='left', va='top', color='red', fontsize=96)
+    ax1.text(0, top * 1.0, f'Total withdrawal: {-total_withdrawal:.2f}', ha='left', va='top', color='green', fontsize=96)
 
     ax2.set_xlim(ax1.get_xlim())
 
-    # Save the plot
-    plt.savefig(output_file, dpi=15)
+    figure.savefig(output_file, dpi=15)
+    figure.clear()
+
+
+PLOTTERS = {
+    'balance': plot_weekly_balance,
+    'series': plot_weekly_series,
+}
+
+
+def render_job(job):
+    kind, data, output_file = job
+    PLOTTERS[kind](data, output_file)
+    return output_file
+
+
+def render_plots(jobs, processes=None):
+    # jobs: (kind, data, output_file) with kind 'balance' or 'series'; data is pickled once per job,
+    # so pass engine results / arrays rather than lists of dicts
+    jobs = list(jobs)
+    if processes == 1 or len(jobs) <= 1:
+        return [render_job(job) for job in jobs]
+    with Pool(min(processes or os.cpu_count(), len(jobs))) as pool:
+        return pool.map(render_job, jobs, chunksize=1)
@@ -0,0 +1,105 @@
+import os
+import pandas as pd
+
+from balance_history import BalanceHistory, RECORD_LABELS, history_columns
+from timestamps import format_times
+
+
+RECORD_TYPES = {int(record_type): label for record_type, label in RECORD_LABELS.items()}
+
+
+def history_frame(result):
+    # The same table save_to_excel wrote, built from columns without going through a list of dicts;
+    # result is a recalculate_balance_arrays result or a BalanceHistory
+    columns = result.columns() if isinstance(result, BalanceHistory) else history_columns(result)
+    return pd.DataFrame({
+        'Время': columns['time'],
+        'Прибыль': columns['profit'],
+        'Баланс': columns['balance'],
+        'Размер серии': columns['series_size'],
+        'Множитель': columns['multiplier'],
+        'Тип': pd.Categorical.from_codes(columns['type'], categories=[RECORD_TYPES[code] for code in sorted(RECORD_TYPES)]),
+        'Сбор дохода': columns['mining'],
+    })
+
+
+def series_frame(series):
+    # SeriesTable -> the '<label>_orig' table; drawdown levels are rendered like the old dict column
+    levels = [str({level: value for level, value in enumerate(series.levels(i).tolist(), 1)}) for i in range(len(series))]
+    return pd.DataFrame({
+        'Время': series.times,
+        'Объем': series.volume,
+        'Баланс': series.balance,
+        'Прибыль': series.profit,
+        'Просадка': series.drawdown,
+        'Размер серии': series.series_size,
+        'Уровни просадки': levels,
+    })
+
+
+def text_times(frame):
+    # Epoch 'Время' becomes the report's 'YYYY.MM.DD HH:MM:SS' text, for formats read by people
+    if 'Время' in frame and pd.api.types.is_integer_dtype(frame['Время']):
+        frame = frame.assign(**{'Время': format_times(frame['Время'].to_numpy())})
+    return frame
+
+
+def typed_times(frame):
+    # Binary formats keep a real timestamp column
+    if 'Время' in frame and pd.api.types.is_integer_dtype(frame['Время']):
+        frame = frame.assign(**{'Время': frame['Время'].to_numpy().astype('datetime64[s]')})
+    return frame
+
+
+def write_csv(frame, filename):
+    text_times(frame).to_csv(filename, index=False)
+
+
+def write_parquet(frame, filename):
+    typed_times(frame).to_parquet(filename, index=False)
+
+
+def write_feather(frame, filename):
+    typed_times(frame).reset_index(drop=True).to_feather(filename)
+
+
+def write_xlsx(frame, filename, startrow=2):
+    # openpyxl write-only mode streams rows to the file instead of building every cell object;
+    # startrow keeps the layout of the old df.to_excel(startrow=2) files
+    from openpyxl import Workbook
+
+    frame = text_times(frame)
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Sheet1')
+    for _ in range(startrow):
+        sheet.append([])
+    sheet.append(list(frame.columns))
+    columns = [frame[column].astype(object).tolist() if frame[column].dtype.name == 'category' else frame[column].tolist()
+               for column in frame.columns]
+    for row in zip(*columns):
+        sheet.append(row)
+    workbook.save(filename)
+
+
+WRITERS = {
+    '.csv': write_csv,
+    '.parquet': write_parquet,
+    '.feather': write_feather,
+    '.xlsx': write_xlsx,
+}
+
+
+def export_frame(frame, filename):
+    # The writer is chosen by the file extension
+    extension = os.path.splitext(filename)[1].lower()
+    if extension not in WRITERS:
+        raise ValueError(f'Unsupported export format {extension!r}, expected one of {sorted(WRITERS)}')
+    WRITERS[extension](frame, filename)
+
+
+def export_history(result, filename):
+    export_frame(history_frame(result), filename)
+
+
+def export_series(series, filename):
+    export_frame(series_frame(series), filename)
@@ -0,0 +1,151 @@
+import os
+import sys
+import json
+import time
+import platform
+import tracemalloc
+from contextlib import contextmanager
+
+
+PROFILERS = ('cprofile', 'pyinstrument')
+PROFILE_DIR = 'files/profiles'
+
+
+def peak_rss_kb():
+    # Peak RSS of the process so far; ru_maxrss is in KB on Linux and in bytes on macOS
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def cpu_times():
+    # CPU of this process and of finished child processes (plot workers) separately
+    times = os.times()
+    return times.user + times.system, times.children_user + times.children_system
+
+
+def start_profiler(profiler):
+    if profiler == 'pyinstrument':
+        from pyinstrument import Profiler
+        session = Profiler()
+        session.start()
+        return session
+    import cProfile
+    session = cProfile.Profile()
+    session.enable()
+    return session
+
+
+def stop_profiler(profiler, session, file_base):
+    if profiler == 'pyinstrument':
+        session.stop()
+        file_name = file_base + '.html'
+        with open(file_name, 'w', encoding='utf-8') as file:
+            file.write(session.output_html())
+        return file_name
+    session.disable()
+    file_name = file_base + '.prof'
+    session.dump_stats(file_name)
+    return file_name
+
+
+class Instrumentation:
+    # Opt-in stage timers for chek_calculates. Disabled instances cost one generator per stage and record nothing,
+    # so the calculation code is instrumented unconditionally. track_memory runs the stages under tracemalloc,
+    # which slows Python-heavy stages several times: such records are marked 'traced' and their times are not
+    # comparable with untraced runs (stages cannot be rerun untraced, they have side effects).
+    def __init__(self, enabled=True, track_memory=False, profile_stage=None, profiler='cprofile', profile_dir=PROFILE_DIR):
+        if profiler not in PROFILERS:
+            raise ValueError(f'Unknown profiler {profiler!r}, expected one of {PROFILERS}')
+        self.enabled = enabled
+        self.track_memory = track_memory
+        self.profile_stage = profile_stage
+        self.profiler = profiler
+        self.profile_dir = profile_dir
+        self.stages = []
+        self.started = time.time()
+        self.open_stages = 0
+
+    @contextmanager
+    def stage(self, name, items=None, **labels):
+        # The yielded dict may be filled inside the block, e.g. record['items'] = len(deals)
+        record = {'stage': name, 'items': items, **labels}
+        if self.track_memory:
+            record['traced'] = True
+        if not self.enabled:
+            yield record
+            return
+
+        tracing = self.track_memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        elif self.track_memory and self.open_stages == 0:
+            tracemalloc.reset_peak()
+        session = start_profiler(self.profiler) if name == self.profile_stage else None
+        self.open_stages += 1
+
+        cpu, children_cpu = cpu_times()
+        wall = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['wall'] = time.perf_counter() - wall
+            cpu_end, children_cpu_end = cpu_times()
+            record['cpu'] = cpu_end - cpu
+            record['children_cpu'] = children_cpu_end - children_cpu
+            self.open_stages -= 1
+
+            if session is not None:
+                os.makedirs(self.profile_dir, exist_ok=True)
+                suffix = '_'.join(str(value) for value in labels.values())
+                file_base = os.path.join(self.profile_dir, f'{name}_{suffix}' if suffix else name)
+                record['profile'] = stop_profiler(self.profiler, session, file_base)
+            if self.track_memory:
+                record['peak_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+            if tracing:
+                tracemalloc.stop()
+            record['peak_rss_kb'] = peak_rss_kb()
+            if record['items'] is not None:
+                record['throughput'] = record['items'] / record['wall'] if record['wall'] else None
+            self.stages.append(record)
+
+    def totals(self):
+        # Wall and CPU time summed per stage name over all parameter sets
+        totals = {}
+        for record in self.stages:
+            total = totals.setdefault(record['stage'], {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'children_cpu': 0.0, 'items': 0})
+            total['calls'] += 1
+            total['wall'] += record['wall']
+            total['cpu'] += record['cpu']
+            total['children_cpu'] += record['children_cpu']
+            total['items'] += record['items'] or 0
+            if 'peak_kb' in record:
+                total['peak_kb'] = max(total.get('peak_kb', 0), record['peak_kb'])
+        return totals
+
+    def report(self):
+        return {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'python': platform.python_version(),
+            'memory_traced': self.track_memory,
+            'wall': sum(record['wall'] for record in self.stages),
+            'stages': self.stages,
+            'totals': self.totals(),
+        }
+
+    def save(self, file_name):
+        with open(file_name, 'w', encoding='utf-8') as file:
+            json.dump(self.report(), file, ensure_ascii=False, indent=2)
+
+    def print_report(self):
+        totals = self.totals()
+        wall = sum(total['wall'] for total in totals.values()) or 1
+        print('Этапы расчета (время под tracemalloc завышено):' if self.track_memory else 'Этапы расчета:')
+        for name, total in sorted(totals.items(), key=lambda item: -item[1]['wall']):
+            peak = f", пик {total['peak_kb']} KB" if 'peak_kb' in total else ''
+            children = f", CPU процессов {total['children_cpu']:.3f} s" if total['children_cpu'] else ''
+            print(f"{name:>16}: {total['wall']:8.3f} s ({total['wall'] / wall:5.1%}), CPU {total['cpu']:.3f} s{children}, "
+                  f"вызовов {total['calls']}, записей {total['items']}{peak}")
@@ -4,31 +4,57 @@ import matplotlib.patches as patches
 from dateutil.relativedelta import relativedelta
 import numpy as np
 '''
-import time
+import argparse
 import pprint
 import math
-from datetime import datetime, timedelta
-from collections import defaultdict
+from itertools import islice
+import numpy as np
 import pandas as pd
 
-from read_reports import parse_html
-from draw_plots import plot_weekly_series, plot_weekly_balance
+from deal_cache import load_deal_columns, to_float
+from deal_series import SeriesTable
+from tiers import risk_tiers, mining_tiers
+from timestamps import to_epoch, date_to_epoch
+from export import WRITERS, write_xlsx, export_history, export_series, history_frame
+from balance_history import BalanceHistory, RecordType, HISTORY_DTYPE
+from balance_engine import recalculate_balance_arrays, final_balance
+from draw_plots import render_plots
+from instrumentation import Instrumentation, PROFILERS
+from result_cache import ResultCache
 
 
 pp = pprint.PrettyPrinter(indent=2)
 
+RISK_MANAGE = {
+    0: 100,
+    15000: 50,
+    45000: 25,
+    135000: 12.5,
+    405000: 6.25,
+}
+
+PROFIT_MINING = {
+    45000: 10,
+    135000: 20,
+}
+
+START_DATE = '01.01.2014'
+END_DATE = '01.01.2024'
+
 
 def calculate_risk_and_split_balance(balance, risk_manage):
     if risk_manage is None:
         return 1, balance, 0  # If no risk level is provided, return 100% risk and all balance is risky
 
-    sorted_risk_levels = sorted(risk_manage.keys(), reverse=True)
-    for level in sorted_risk_levels:
-        if balance >= level:
-            risk_percent = risk_manage[level] / 100
-            risky_balance = balance * risk_percent
-            buffer_balance = balance - risky_balance
-            return risk_percent, risky_balance, buffer_balance
+    # A dict is compiled on every call; recalculate_balance passes an already compiled TierTable
+    risk_table = risk_tiers(risk_manage)
+    risk_percent = risk_table.percent(balance)
+    if risk_percent is None:
+        raise ValueError(f'Balance {balance} is below the lowest risk_manage level {risk_table.levels[0]}')
+    risk_percent = risk_percent / 100
+    risky_balance = balance * risk_percent
+    buffer_balance = balance - risky_balance
+    return risk_percent, risky_balance, buffer_balance
 
 
 def process_deals(deals):
@@ -37,11 +63,11 @@ def process_deals(deals):
     series_length = 0
     drawdown_levels = {}
     series_start_balance = None  # добавляем переменную для хранения начала баланса на начало серии
-    deals.pop(0)
 
-    for deal in deals:
-        profit = float(deal['Прибыль'].replace(" ", ""))
-        balance = float(deal['Баланс'].replace(" ", ""))
+    # The first row is the initial balance; skip it without modifying the caller's list
+    for deal in islice(deals, 1, None):
+        profit = to_float(deal['Прибыль'])
+        balance = to_float(deal['Баланс'])
 
         if series_start_balance is None or drawdown == 0:
             series_start_balance = balance - profit
@@ -86,19 +112,22 @@ def process_deals(deals):
 def recalculate_balance(processed_deals, initial_balance, drawdown_level, start_date=None, end_date=None, multiplier=3000, risk_manage=None, profit_mining=None):
     first_deposit = initial_balance
     balance = initial_balance
-    balance_history = []
+    # Records are collected as columns and returned as a BalanceHistory instead of one dict per record
+    history = {name: [] for name in HISTORY_DTYPE.names}
     withdrawals = 0  # Initialize the withdrawals counter
     deposits = 1  # Initialize the deposits counter
 
-    # Convert start_date and end_date to datetime objects if they are not None and are strings
-    if start_date is not None and isinstance(start_date, str):
-        start_date = datetime.strptime(start_date, '%d.%m.%Y')
-    if end_date is not None and isinstance(end_date, str):
-        end_date = datetime.strptime(end_date, '%d.%m.%Y')
+    # Compile the tier tables once instead of sorting them on every deal
+    risk_manage = risk_tiers(risk_manage)
+    profit_mining = mining_tiers(profit_mining)
+
+    # Convert start_date and end_date to epoch seconds, deal times are compared as integers
+    start_date = date_to_epoch(start_date)
+    end_date = date_to_epoch(end_date)
 
     for deal in processed_deals:
         # Parse the deal date
-        deal_date = datetime.strptime(deal['Время'], '%Y.%m.%d %H:%M:%S')  # adjust the format as necessary
+        deal_date = to_epoch(deal['Время'])  # epoch seconds; report strings are still accepted
 
         # If start_date and end_date are provided, skip the deal if it's not within the date range
         if start_date is not None and deal_date < start_date:
@@ -136,140 +165,151 @@ def recalculate_balance(processed_deals, initial_balance, drawdown_level, start_
 
         # Calculate profit mining
         profit_mining_deduction = 0
-        if profit_mining is not None:
-            for level in sorted(profit_mining.keys(), reverse=True):
-                if balance >= level and balance_change > 0:
-                    profit_mining_deduction = balance_change * profit_mining[level] / 100
-                    balance_change -= profit_mining_deduction
-                    balance -= profit_mining_deduction
-                    break
-
-        balance_history.append({
-            'Время': deal['Время'],
-            'Прибыль': balance_change,
-            'Баланс': balance,
-            'Размер серии': deal['Размер серии'],
-            'Множитель': balance_ratio,
-            'Тип': 'сделка',
-            'Сбор дохода': profit_mining_deduction,
-        })
+        if profit_mining is not None and balance_change > 0:
+            mining_percent = profit_mining.percent(balance)
+            if mining_percent is not None:
+                profit_mining_deduction = balance_change * mining_percent / 100
+                balance_change -= profit_mining_deduction
+                balance -= profit_mining_deduction
+
+        add_record(history, deal_date, balance_change, balance, deal['Размер серии'], balance_ratio, RecordType.DEAL, profit_mining_deduction)
 
         # If balance is less than first_deposit, add a deposit
         if balance < first_deposit:
-            deposit_date = deal_date + timedelta(seconds=5)
+            deposit_date = deal_date + 5
             deposit_amount = first_deposit - balance
             balance += deposit_amount
             deposits += 1  # Increase the deposits counter
-            balance_history.append({
-                'Время': deposit_date.strftime('%Y.%m.%d %H:%M:%S'),
-                'Прибыль': deposit_amount,
-                'Баланс': balance,
-                'Размер серии': 0,
-                'Множитель': 0,
-                'Тип': 'пополнение',
-                'Сбор дохода': 0,
-            })
+            add_record(history, deposit_date, deposit_amount, balance, 0, 0, RecordType.DEPOSIT, 0)
 
         # If balance_ratio exceeds 2 and balance exceeds first_deposit, add a withdrawal
         # But only if the number of withdrawals is less than the number of deposits
         if balance >= ((multiplier * 2) + first_deposit) and withdrawals < deposits:
-            withdrawal_date = deal_date + timedelta(seconds=5)
+            withdrawal_date = deal_date + 5
             balance -= first_deposit
             withdrawals += 1  # Increase the withdrawals counter
-            balance_history.append({
-                'Время': withdrawal_date.strftime('%Y.%m.%d %H:%M:%S'),
-                'Прибыль': -first_deposit,
-                'Баланс': balance,
-                'Размер серии': 0,
-                'Множитель': 0,
-                'Тип': 'снятие средств',
-                'Сбор дохода': 0,
-            })
-
-    return balance_history
-
-
-def count_series_size(processed_deals):
-    series_size_count = {}
-    for deal in processed_deals:
-        series_size = deal['Размер серии']
-        if series_size in series_size_count:
-            series_size_count[series_size] += 1
-        else:
-            series_size_count[series_size] = 1
-    return series_size_count
-
-
-def count_income(balance_history):
-    monthly_income = defaultdict(float)  # A dictionary to hold monthly income
-    annual_income = defaultdict(float)  # A dictionary to hold annual income
-    total_income = 0.0  # A variable to hold the total income
-
-    # Go through each record in balance history
-    for record in balance_history:
-        # Parse the date
-        date = datetime.strptime(record['Время'], '%Y.%m.%d %H:%M:%S')
-        # Get the income
-        income = int(record['Сбор дохода'])
-        # Add the income to the appropriate month in the monthly income dictionary
-        month_key = (date.year, date.month)
-        monthly_income[month_key] += income
-        # Add the income to the appropriate year in the annual income dictionary
-        annual_income[date.year] += income
-        # Add the income to the total income
-        total_income += income
-
-    # Convert the keys in the monthly income dictionary to strings for readability
-    monthly_income = {(f'{year}-{month:02}'): income for (year, month), income in monthly_income.items()}
+            add_record(history, withdrawal_date, -first_deposit, balance, 0, 0, RecordType.WITHDRAWAL, 0)
+
+    return BalanceHistory.from_columns(history)
+
+
+def add_record(history, time, profit, balance, series_size, multiplier, record_type, mining):
+    history['time'].append(time)
+    history['profit'].append(profit)
+    history['balance'].append(balance)
+    history['series_size'].append(series_size)
+    history['multiplier'].append(multiplier)
+    history['type'].append(record_type)
+    history['mining'].append(mining)
+
+
+def series_size_column(processed_deals):
+    # 'Размер серии' as an array from a SeriesTable, balance_engine arrays or a list of process_deals dicts
+    if isinstance(processed_deals, SeriesTable):
+        return processed_deals.series_size
+    if isinstance(processed_deals, dict):
+        return np.asarray(processed_deals['series_size'])
+    return np.fromiter((deal['Размер серии'] for deal in processed_deals), dtype=np.int64, count=len(processed_deals))
+
+
+def count_series_size(processed_deals, as_frame=False):
+    sizes, counts = np.unique(series_size_column(processed_deals), return_counts=True)
+    if as_frame:
+        return pd.DataFrame({'series_size': sizes, 'count': counts})
+    return dict(zip(sizes.tolist(), counts.tolist()))
+
+
+def income_columns(balance_history):
+    # (epoch times, income) of every record; an engine result is read directly, its deposit and
+    # withdrawal rows (5 seconds after their deal, no income) are added so month keys stay the same
+    if isinstance(balance_history, dict):
+        event_times = balance_history['times'][balance_history['event_index']] + 5
+        times = np.concatenate((balance_history['times'], event_times))
+        income = np.concatenate((np.trunc(balance_history['mining']), np.zeros(len(event_times))))
+        return times, income
+    if isinstance(balance_history, BalanceHistory):
+        return balance_history['time'], np.trunc(balance_history['mining'])
+    times = np.fromiter((to_epoch(record['Время']) for record in balance_history), dtype=np.int64, count=len(balance_history))
+    income = np.fromiter((int(record['Сбор дохода']) for record in balance_history), dtype=np.float64, count=len(balance_history))
+    return times, income
+
+
+def count_income(balance_history, as_frame=False):
+    times, income = income_columns(balance_history)
+
+    # Group by months since 1970-01 and by calendar year
+    months = times.astype('datetime64[s]').astype('datetime64[M]').astype(np.int64)
+    month_keys, month_index = np.unique(months, return_inverse=True)
+    monthly_income = np.bincount(month_index, weights=income, minlength=len(month_keys))
+    year_keys, year_index = np.unique(month_keys // 12 + 1970, return_inverse=True)
+    annual_income = np.bincount(year_index, weights=monthly_income, minlength=len(year_keys))
 
     # Calculate average annual income, considering only years with non-zero income
-    non_zero_annual_incomes = [income for income in annual_income.values() if income != 0]
-    average_annual_income = sum(non_zero_annual_incomes) / len(non_zero_annual_incomes) if non_zero_annual_incomes else 0
+    non_zero_annual_incomes = annual_income[annual_income != 0]
+    average_annual_income = float(non_zero_annual_incomes.sum() / len(non_zero_annual_incomes)) if len(non_zero_annual_incomes) else 0
+    total_income = float(income.sum())
+
+    month_labels = [f'{month // 12 + 1970}-{month % 12 + 1:02}' for month in month_keys.tolist()]
+    if as_frame:
+        monthly = pd.DataFrame({'month': month_labels, 'income': monthly_income})
+        annual = pd.DataFrame({'year': year_keys, 'income': annual_income})
+    else:
+        monthly = dict(zip(month_labels, monthly_income.tolist()))
+        annual = dict(zip(year_keys.tolist(), annual_income.tolist()))
 
     return {
-        'monthly_income': dict(monthly_income),
-        'annual_income': dict(annual_income),
+        'monthly_income': monthly,
+        'annual_income': annual,
         'average_annual_income': average_annual_income,
         'total_income': total_income
     }
 
 
 def save_to_excel(data, filename):
-    df = pd.DataFrame(data)  # Создаем DataFrame из списка словарей
-    df.to_excel(filename, index=False, startrow=2)  # Записываем DataFrame в xlsx файл
-
-
-def chek_calculates(calc_params, history_file, label):
-
-    risk_manage = {
-        0: 100,
-        15000: 50,
-        45000: 25,
-        135000: 12.5,
-        405000: 6.25,
-    }
-
-    profit_mineing = {
-        45000: 10,
-        135000: 20,
-    }
-
-    deals = parse_html(history_file)
-    processed_deals = process_deals(deals)
-    count_series = count_series_size(processed_deals)
-    save_to_excel(processed_deals, f'files/{label}_orig.xlsx')
-
-    start_date = '01.01.2014'
-    end_date = '01.01.2024'
+    # BalanceHistory goes to a DataFrame column by column, a list of dicts as before
+    df = history_frame(data) if isinstance(data, BalanceHistory) else pd.DataFrame(data)
+    write_xlsx(df, filename)  # Потоковая запись xlsx, время пишется строкой
+
+
+def chek_calculates(calc_params, history_file, label, export_format='csv', plot_processes=None, instrumentation=None, result_cache=None):
+    risk_manage = RISK_MANAGE
+    profit_mineing = PROFIT_MINING
+    # Stage timings are collected only when an enabled Instrumentation is passed
+    stage = (instrumentation or Instrumentation(enabled=False)).stage
+    # With a ResultCache unchanged parameter sets are loaded from disk instead of recalculated
+    recalculate = result_cache.recalculate if result_cache else recalculate_balance_arrays
+
+    with stage('load_deals') as record:
+        columns = load_deal_columns(history_file)
+        record['items'] = len(columns)
+    with stage('process_deals', len(columns)):
+        series = SeriesTable.from_columns(columns)
+        arrays = series.arrays()
+    with stage('count_series', len(series)):
+        count_series = count_series_size(series)
+    # export_format: 'csv', 'parquet', 'feather', 'xlsx' or None to skip the tables; xlsx is the slowest by far
+    if export_format:
+        with stage('export_series', len(series)):
+            export_series(series, f'files/{label}_orig.{export_format}')
+
+    start_date = START_DATE
+    end_date = END_DATE
+    plot_jobs = []
 
     for current_params in calc_params:
         multiplier = current_params['initial_balance']
         label2 = f"{current_params['drawdown_level']:02d}_{current_params['initial_balance']}"
-        calculated_deals = recalculate_balance(processed_deals, current_params['initial_balance'], current_params['drawdown_level'], start_date, end_date, multiplier, risk_manage, profit_mineing)
+        with stage('simulate', params=label2) as record:
+            result = recalculate(arrays, current_params['initial_balance'], current_params['drawdown_level'], start_date, end_date, multiplier, risk_manage, profit_mineing)
+            record['items'] = len(result['balance'])
+        records = len(result['balance']) + len(result['event_index'])
         render_plot_file = f'files/{label}_{label2}.png'
-        plot_weekly_balance(calculated_deals, render_plot_file)
-        save_to_excel(calculated_deals, f'files/{label}_{label2}.xlsx')
-        incomes = count_income(calculated_deals)
+        plot_jobs.append(('balance', result, render_plot_file))
+        if export_format:
+            with stage('export_history', records, params=label2):
+                export_history(result, f'files/{label}_{label2}.{export_format}')
+        with stage('count_income', records, params=label2):
+            incomes = count_income(result)
 
         print('=====================')
         print(f'initial_balance: {current_params["initial_balance"]}')
@@ -278,11 +318,17 @@ def chek_calculates(calc_params, history_file, label):
         print('Годовой доход:')
         pp.pprint(incomes['annual_income'])
         print(f'Средний годовой доход: {int(incomes["average_annual_income"])}')
-        print(f'Итоговый баланс: {calculated_deals[-1]["Баланс"]}')
-        print(f'Количество трейдов: {len(calculated_deals)}\n')
+        print(f'Итоговый баланс: {final_balance(result)}')
+        print(f'Количество трейдов: {records}\n')
 
     print('Распределение серий:')
     pp.pprint(count_series)
+    if result_cache:
+        result_cache.print_stats()
+
+    # Plots of all parameter sets are rendered together in worker processes
+    with stage('render_plots', len(plot_jobs)):
+        render_plots(plot_jobs, plot_processes)
 
 
 def main():
@@ -294,7 +340,28 @@ def main():
         {'initial_balance': 2000, 'drawdown_level': 10},
         {'initial_balance': 4000, 'drawdown_level': 11},
         ]
-    chek_calculates(calc_params, history_file, label)
+
+    parser = argparse.ArgumentParser(description='Расчет баланса по отчету тестера')
+    parser.add_argument('--instrument', metavar='REPORT', help='Замерить этапы расчета и сохранить отчет в JSON')
+    parser.add_argument('--memory', dest='track_memory', action='store_true',
+                        help='Отслеживать пик памяти этапов (tracemalloc замедляет этапы, время завышено)')
+    parser.add_argument('--profile-stage', help='Профилировать этап (load_deals, process_deals, simulate, export_history, render_plots, ...)')
+    parser.add_argument('--profiler', choices=PROFILERS, default='cprofile')
+    parser.add_argument('--export-format', choices=[extension[1:] for extension in WRITERS] + ['none'], default='csv',
+                        help='Формат таблиц сделок и баланса; xlsx в десятки раз медленнее остальных, none - только итоги')
+    parser.add_argument('--no-result-cache', dest='result_cache', action='store_false', help='Пересчитать все наборы параметров')
+    args = parser.parse_args()
+
+    instrumentation = None
+    if args.instrument or args.profile_stage:
+        instrumentation = Instrumentation(track_memory=args.track_memory, profile_stage=args.profile_stage, profiler=args.profiler)
+    result_cache = ResultCache() if args.result_cache else None
+    export_format = None if args.export_format == 'none' else args.export_format
+    chek_calculates(calc_params, history_file, label, export_format, instrumentation=instrumentation, result_cache=result_cache)
+    if instrumentation:
+        instrumentation.print_report()
+        if args.instrument:
+            instrumentation.save(args.instrument)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,160 @@
+import os
+import argparse
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+
+from deal_cache import load_deal_columns
+from deal_series import SeriesTable
+from balance_engine import date_window, deal_losses, final_balance
+from balance_kernel import DEPOSIT, WITHDRAWAL, run_balance_kernel
+from export import export_frame
+from main_calculator import RISK_MANAGE, PROFIT_MINING, START_DATE, END_DATE
+
+
+METHODS = ('bootstrap', 'block', 'shuffle')
+
+# Per-worker simulation inputs, sent once through the pool initializer
+worker_state = None
+
+
+def year_index(times):
+    # Calendar year of every deal as 0..n_years-1, used to bin income by year like count_income
+    years = times.astype('datetime64[s]').astype('datetime64[Y]').astype(np.int64) + 1970
+    unique_years, index = np.unique(years, return_inverse=True)
+    return unique_years, index
+
+
+def resample_indices(rng, count, method, block_size):
+    # One alternative ordering of the historical series results
+    if method == 'bootstrap':
+        return rng.integers(0, count, size=count)
+    if method == 'shuffle':
+        return rng.permutation(count)
+    if method == 'block':
+        # Circular block bootstrap keeps runs of neighbouring series together
+        blocks = -(-count // block_size)
+        starts = rng.integers(0, count, size=blocks)
+        return ((starts[:, None] + np.arange(block_size)) % count).ravel()[:count]
+    raise ValueError(f'Unknown resampling method: {method}')
+
+
+def simulate_batch(state, seed, paths):
+    rng = np.random.default_rng(seed)
+    losses = state['losses']
+    count = len(losses)
+    rows = []
+    for _ in range(paths):
+        indices = resample_indices(rng, count, state['method'], state['block_size'])
+        result = run_balance_kernel(losses[indices], state['initial_balance'], state['multiplier'],
+                                    state['risk_manage'], state['profit_mining'])
+
+        annual_income = np.bincount(state['year_index'], weights=np.trunc(result['mining']), minlength=state['years'])
+        non_zero = annual_income[annual_income != 0]
+        event_type = result['event_type']
+
+        rows.append((
+            final_balance(result),
+            int((event_type == DEPOSIT).sum()),
+            int((event_type == WITHDRAWAL).sum()),
+            float(annual_income.sum()),
+            float(non_zero.mean()) if len(non_zero) else 0.0,
+        ))
+    return rows
+
+
+def init_worker(state):
+    global worker_state
+    worker_state = state
+
+
+def simulate_task(task):
+    seed, paths = task
+    return simulate_batch(worker_state, seed, paths)
+
+
+def simulate(arrays, initial_balance, drawdown_level, paths=10000, method='bootstrap', block_size=20,
+             start_date=START_DATE, end_date=END_DATE, multiplier=None, risk_manage=RISK_MANAGE, profit_mining=PROFIT_MINING,
+             seed=0, batch_size=500, processes=None):
+    # Seeds are spawned per batch, not per worker, so results do not depend on the number of processes
+    if method not in METHODS:
+        raise ValueError(f'Unknown resampling method: {method}')
+    if block_size < 1:
+        raise ValueError(f'block_size must be at least 1, got {block_size}')
+    left, right = date_window(arrays['times'], start_date, end_date)
+    if right <= left:
+        raise ValueError('No deals in the selected date window')
+
+    unique_years, index = year_index(arrays['times'][left:right])
+    state = {
+        'losses': np.ascontiguousarray(deal_losses(arrays, drawdown_level, left, right)),
+        'year_index': index,
+        'years': len(unique_years),
+        'method': method,
+        'block_size': block_size,
+        'initial_balance': initial_balance,
+        'multiplier': initial_balance if multiplier is None else multiplier,
+        'risk_manage': risk_manage,
+        'profit_mining': profit_mining,
+    }
+
+    batch_sizes = [min(batch_size, paths - start) for start in range(0, paths, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(batch_sizes))
+    tasks = list(zip(seeds, batch_sizes))
+
+    if processes == 1:
+        batches = [simulate_batch(state, task_seed, task_paths) for task_seed, task_paths in tasks]
+    else:
+        with Pool(processes or os.cpu_count(), initializer=init_worker, initargs=(state,)) as pool:
+            batches = pool.map(simulate_task, tasks, chunksize=1)
+
+    rows = [row for batch in batches for row in batch]
+    return pd.DataFrame(rows, columns=['final_balance', 'deposits', 'withdrawals', 'total_income', 'average_annual_income'])
+
+
+def summarize_paths(table, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95)):
+    # Ruin here means at least one top-up deposit was needed
+    return {
+        'paths': len(table),
+        'ruin_probability': float((table['deposits'] > 0).mean()),
+        'deposits': table['deposits'].value_counts().sort_index().to_dict(),
+        'final_balance': table['final_balance'].quantile(quantiles).to_dict(),
+        'average_annual_income': table['average_annual_income'].quantile(quantiles).to_dict(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Monte Carlo / bootstrap проверка устойчивости параметров')
+    parser.add_argument('report', help='HTML отчет тестера MT5')
+    parser.add_argument('--initial-balance', type=int, default=500)
+    parser.add_argument('--drawdown-level', type=int, default=8)
+    parser.add_argument('--paths', type=int, default=10000)
+    parser.add_argument('--method', choices=METHODS, default='bootstrap')
+    parser.add_argument('--block-size', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--processes', type=int)
+    parser.add_argument('--output', help='Сохранить результаты всех путей (.csv, .parquet, .feather, .xlsx)')
+    args = parser.parse_args()
+
+    arrays = SeriesTable.from_columns(load_deal_columns(args.report)).arrays()
+    table = simulate(arrays, args.initial_balance, args.drawdown_level, args.paths, args.method, args.block_size,
+                     seed=args.seed, processes=args.processes)
+    summary = summarize_paths(table)
+
+    print(f"Путей: {summary['paths']}")
+    print(f"Вероятность пополнения: {summary['ruin_probability']:.2%}")
+    print('Количество пополнений:')
+    for deposits, paths in summary['deposits'].items():
+        print(f'  {deposits}: {paths}')
+    print('Итоговый баланс (квантили):')
+    for quantile, value in summary['final_balance'].items():
+        print(f'  {quantile:.0%}: {value:.2f}')
+    print('Средний годовой доход (квантили):')
+    for quantile, value in summary['average_annual_income'].items():
+        print(f'  {quantile:.0%}: {value:.2f}')
+    if args.output:
+        export_frame(table, args.output)
+
+
+if __name__ == '__main__':
+    main()
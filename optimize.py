@@ -0,0 +1,298 @@
+import os
+import argparse
+import itertools
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+
+import sweep
+from deal_cache import load_deal_columns
+from deal_series import SeriesTable
+from balance_engine import date_window, recalculate_slice, final_balance
+from balance_kernel import DEPOSIT
+from export import export_frame
+from main_calculator import count_income, PROFIT_MINING, START_DATE, END_DATE
+
+
+# Adaptive search over initial_balance, drawdown_level and the risk_manage tiers. Every round is a
+# successive halving: all candidates run on the first part of the history, only the best 1/eta go on
+# to a longer part, and so on up to the full window. The next round is a finer grid around the best
+# candidates. Evaluations run in parallel batches on deal arrays shared like in sweep.py.
+
+# RISK_MANAGE is the geometric table geometric_tiers(15000, 0.5): the first threshold,
+# every next one `ratio` times higher, the percent multiplied by `decay` at every step
+RISK_LEVELS = 5
+RISK_RATIO = 3
+
+
+class Axis:
+    # One searched parameter: a closed range, optionally integer and/or log-spaced
+    __slots__ = ('name', 'low', 'high', 'integer', 'log')
+
+    def __init__(self, name, low, high, integer=False, log=False):
+        if low > high:
+            raise ValueError(f'{name}: low {low} is above high {high}')
+        self.name = name
+        self.low = low
+        self.high = high
+        self.integer = integer
+        self.log = log
+
+    def to_unit(self, value):
+        if self.high == self.low:
+            return 0.0
+        if self.log:
+            return (np.log(value) - np.log(self.low)) / (np.log(self.high) - np.log(self.low))
+        return (value - self.low) / (self.high - self.low)
+
+    def from_unit(self, unit):
+        unit = min(max(unit, 0.0), 1.0)
+        if self.log:
+            value = float(np.exp(np.log(self.low) + unit * (np.log(self.high) - np.log(self.low))))
+        else:
+            value = self.low + unit * (self.high - self.low)
+        return int(round(value)) if self.integer else round(float(value), 6)
+
+
+DEFAULT_SPACE = [
+    Axis('initial_balance', 250, 8000, integer=True, log=True),
+    Axis('drawdown_level', 6, 13, integer=True),
+    Axis('risk_first', 5000, 60000, integer=True, log=True),
+    Axis('risk_decay', 0.25, 1.0),
+]
+
+
+def geometric_tiers(first, decay, levels=RISK_LEVELS, ratio=RISK_RATIO):
+    tiers = {0: 100.0}
+    threshold, percent = first, 100.0
+    for _ in range(levels - 1):
+        percent *= decay
+        tiers[threshold] = percent
+        threshold *= ratio
+    return tiers
+
+
+def candidate_params(candidate):
+    # Search point -> recalculate_balance arguments; multiplier follows initial_balance like chek_calculates
+    risk_manage = geometric_tiers(candidate['risk_first'], candidate['risk_decay']) if 'risk_first' in candidate else None
+    return candidate['initial_balance'], candidate['drawdown_level'], candidate['initial_balance'], risk_manage
+
+
+def objective_income(result, deposit_penalty):
+    # Average annual income of count_income, minus a fixed price for every deposit the account needed
+    deposits = int(np.count_nonzero(result['event_type'] == DEPOSIT))
+    return count_income(result)['average_annual_income'] - deposit_penalty * deposits
+
+
+def objective_final_balance(result, deposit_penalty):
+    deposits = int(np.count_nonzero(result['event_type'] == DEPOSIT))
+    return (final_balance(result) or 0.0) - deposit_penalty * deposits
+
+
+OBJECTIVES = {
+    'income': objective_income,
+    'final_balance': objective_final_balance,
+}
+
+
+def net_result(result, initial_balance):
+    # Trading result with deposits and withdrawals taken out; breaks ties of the objective, e.g. the
+    # many candidates without any income on a short part of the history
+    flows = float(result['event_amount'].sum())
+    return (final_balance(result) or initial_balance) - flows - initial_balance
+
+
+def evaluate_candidate(arrays, candidate, left, right, objective, deposit_penalty, profit_mining):
+    # (objective, net result): candidates are ranked by the objective first
+    initial_balance, drawdown_level, multiplier, risk_manage = candidate_params(candidate)
+    result = recalculate_slice(arrays, left, right, initial_balance, drawdown_level, multiplier, risk_manage, profit_mining)
+    return float(OBJECTIVES[objective](result, deposit_penalty)), net_result(result, initial_balance)
+
+
+def evaluate_task(task):
+    return evaluate_candidate(sweep.worker_arrays, *task)
+
+
+def grid_points(space, points):
+    # `points` evenly spaced values per axis (fewer for narrow integer axes), duplicates removed
+    axes = [sorted({axis.from_unit(unit) for unit in np.linspace(0, 1, points)}) for axis in space]
+    return [dict(zip((axis.name for axis in space), values)) for values in itertools.product(*axes)]
+
+
+def refine_points(space, centers, spread):
+    # Three points per axis around every center, `spread` apart in unit coordinates
+    candidates = []
+    for center in centers:
+        axes = [sorted({axis.from_unit(axis.to_unit(center[axis.name]) + offset) for offset in (-spread, 0.0, spread)})
+                for axis in space]
+        candidates.extend(dict(zip((axis.name for axis in space), values)) for values in itertools.product(*axes))
+    return candidates
+
+
+def params_key(candidate):
+    # Candidates with the same recalculate_balance arguments are one candidate, e.g. every risk_first when
+    # risk_decay is 1.0: tiers are compared without the thresholds that keep the percent of the tier below
+    initial_balance, drawdown_level, multiplier, risk_manage = candidate_params(candidate)
+    tiers = None
+    if risk_manage is not None:
+        tiers, percent = [], None
+        for level, value in sorted(risk_manage.items()):
+            if value != percent:
+                tiers.append((level, value))
+                percent = value
+        tiers = tuple(tiers)
+    return initial_balance, drawdown_level, multiplier, tiers
+
+
+def check_search(points, rounds, top, eta, min_fraction):
+    if points < 1 or rounds < 1 or top < 1:
+        raise ValueError(f'points, rounds and top must be at least 1, got {points}, {rounds}, {top}')
+    if eta < 2:
+        raise ValueError(f'eta must be at least 2, got {eta}')
+    if not 0 < min_fraction <= 1:
+        raise ValueError(f'min_fraction must be in (0, 1], got {min_fraction}')
+
+
+class Optimizer:
+    def __init__(self, arrays, space=None, objective='income', deposit_penalty=1000.0, profit_mining=PROFIT_MINING,
+                 start_date=START_DATE, end_date=END_DATE, processes=None):
+        if objective not in OBJECTIVES:
+            raise ValueError(f'Unknown objective {objective!r}, expected one of {sorted(OBJECTIVES)}')
+        self.arrays = arrays
+        self.space = space or DEFAULT_SPACE
+        self.objective = objective
+        self.deposit_penalty = deposit_penalty
+        self.profit_mining = profit_mining
+        self.left, self.right = date_window(arrays['times'], start_date, end_date)
+        self.processes = processes
+        self.pool = None
+        self.workers = 1
+        self.blocks = []
+        self.scores = {}  # (params key, right) -> score, nothing is evaluated twice
+        self.history = []
+
+    def __enter__(self):
+        if self.processes != 1:
+            self.blocks, specs = sweep.share_arrays(self.arrays)
+            self.workers = self.processes or os.cpu_count()
+            self.pool = Pool(self.workers, initializer=sweep.init_worker, initargs=(specs,))
+        return self
+
+    def __exit__(self, *exc):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        sweep.release_blocks(self.blocks)
+        self.blocks = []
+
+    def evaluate(self, candidates, right):
+        # One parallel batch; scores of candidates already run on the same part of the history are reused
+        todo = [candidate for candidate in candidates if (params_key(candidate), right) not in self.scores]
+        tasks = [(candidate, self.left, right, self.objective, self.deposit_penalty, self.profit_mining) for candidate in todo]
+        if self.pool is None:
+            scores = [evaluate_candidate(self.arrays, *task) for task in tasks]
+        else:
+            chunksize = max(1, len(tasks) // (self.workers * 4))
+            scores = self.pool.map(evaluate_task, tasks, chunksize=chunksize)
+        for candidate, score in zip(todo, scores):
+            self.scores[params_key(candidate), right] = score
+        return [self.scores[params_key(candidate), right] for candidate in candidates]
+
+    def successive_halving(self, candidates, round_number, eta=3, min_fraction=0.25):
+        # Rungs at min_fraction, min_fraction * eta, ... of the window; the last rung is always the full window
+        fractions = []
+        fraction = min_fraction
+        while fraction < 1:
+            fractions.append(fraction)
+            fraction *= eta
+        fractions.append(1.0)
+
+        unique = {}
+        for candidate in candidates:
+            unique.setdefault(params_key(candidate), candidate)
+        survivors = list(unique.values())
+        for rung, fraction in enumerate(fractions):
+            right = self.left + max(1, int(round((self.right - self.left) * fraction)))
+            scores = self.evaluate(survivors, right)
+            for candidate, (score, net) in zip(survivors, scores):
+                self.history.append({'round': round_number, 'rung': rung, 'fraction': fraction, **candidate, 'score': score, 'net': net})
+            order = sorted(range(len(scores)), key=scores.__getitem__, reverse=True)
+            if fraction < 1:
+                keep = max(1, int(np.ceil(len(survivors) / eta)))
+                survivors = [survivors[i] for i in order[:keep]]
+            else:
+                survivors = [survivors[i] for i in order]
+                final_scores = [scores[i] for i in order]
+        return survivors, final_scores
+
+    def run(self, points=4, rounds=3, top=3, eta=3, min_fraction=0.25):
+        # Coarse grid first, then `rounds - 1` finer grids around the `top` best candidates so far
+        check_search(points, rounds, top, eta, min_fraction)
+        candidates = grid_points(self.space, points)
+        spread = 1.0 / max(points - 1, 1) / 2
+        finished = {}  # params key -> (candidate, score) of every candidate that reached the full window
+        leaders = []
+        for round_number in range(rounds):
+            survivors, scores = self.successive_halving(candidates, round_number, eta, min_fraction)
+            for candidate, score in zip(survivors, scores):
+                finished.setdefault(params_key(candidate), (candidate, score))
+            leaders = sorted(finished.values(), key=lambda item: item[1], reverse=True)[:top]
+            candidates = refine_points(self.space, [candidate for candidate, _ in leaders], spread)
+            spread /= 2
+        return [{**candidate, 'score': score, 'net': net} for candidate, (score, net) in leaders]
+
+    def history_frame(self):
+        return pd.DataFrame(self.history)
+
+
+def optimize(arrays, space=None, objective='income', deposit_penalty=1000.0, points=4, rounds=3, top=3, eta=3, min_fraction=0.25,
+             profit_mining=PROFIT_MINING, start_date=START_DATE, end_date=END_DATE, processes=None):
+    with Optimizer(arrays, space, objective, deposit_penalty, profit_mining, start_date, end_date, processes) as optimizer:
+        best = optimizer.run(points, rounds, top, eta, min_fraction)
+    return pd.DataFrame(best), optimizer.history_frame()
+
+
+def int_at_least(minimum):
+    def parse(value):
+        number = int(value)
+        if number < minimum:
+            raise argparse.ArgumentTypeError(f'должно быть не меньше {minimum}: {value}')
+        return number
+    return parse
+
+
+def fraction(value):
+    number = float(value)
+    if not 0 < number <= 1:
+        raise argparse.ArgumentTypeError(f'должно быть в (0, 1]: {value}')
+    return number
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Подбор initial_balance, drawdown_level и уровней риска')
+    parser.add_argument('report', help='HTML отчет тестера MT5')
+    parser.add_argument('--objective', choices=sorted(OBJECTIVES), default='income')
+    parser.add_argument('--deposit-penalty', type=float, default=1000.0, help='Штраф за каждое пополнение')
+    parser.add_argument('--points', type=int_at_least(1), default=4, help='Точек на ось в грубой сетке')
+    parser.add_argument('--rounds', type=int_at_least(1), default=3, help='Раундов уточнения')
+    parser.add_argument('--top', type=int_at_least(1), default=3)
+    parser.add_argument('--eta', type=int_at_least(2), default=3, help='Во сколько раз сокращается число кандидатов на каждой ступени')
+    parser.add_argument('--min-fraction', type=fraction, default=0.25, help='Доля истории на первой ступени')
+    parser.add_argument('--start-date', default=START_DATE)
+    parser.add_argument('--end-date', default=END_DATE)
+    parser.add_argument('--processes', type=int)
+    parser.add_argument('--history', help='Сохранить все оценки (.csv, .parquet, .feather, .xlsx)')
+    args = parser.parse_args()
+
+    arrays = SeriesTable.from_columns(load_deal_columns(args.report)).arrays()
+    best, history = optimize(arrays, None, args.objective, args.deposit_penalty, args.points, args.rounds, args.top, args.eta,
+                             args.min_fraction, PROFIT_MINING, args.start_date, args.end_date, args.processes)
+    print(f'Оценок: {len(history)}')
+    print(best.to_string())
+    if args.history:
+        export_frame(history, args.history)
+
+
+if __name__ == '__main__':
+    main()
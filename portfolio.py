@@ -0,0 +1,201 @@
+import heapq
+import argparse
+import numpy as np
+import pandas as pd
+
+from deal_cache import load_deal_columns
+from deal_series import SeriesState, iter_series
+from balance_kernel import DEPOSIT, WITHDRAWAL, run_balance_kernel
+from balance_engine import final_balance, series_loss
+from tiers import risk_tiers, mining_tiers
+from timestamps import date_to_epoch
+from main_calculator import RISK_MANAGE, PROFIT_MINING, START_DATE, END_DATE
+
+
+# Several reports traded on one account: series of every report are streamed straight from the
+# memory-mapped deal cache, merged by time with heapq.merge and run through the balance kernel
+# chunk by chunk with the account state carried over. Memory is bounded by one chunk plus one
+# open series per report, whatever the number of reports and deals.
+
+CHUNK = 1 << 16
+ROW_BLOCK = 1 << 14
+
+
+class Stream:
+    # One report of the portfolio; weight scales its losses, e.g. 0.5 for half the lot
+    __slots__ = ('name', 'columns', 'drawdown_level', 'weight')
+
+    def __init__(self, name, columns, drawdown_level, weight=1.0):
+        self.name = name
+        self.columns = columns
+        self.drawdown_level = drawdown_level
+        self.weight = weight
+
+
+def stream_deals(stream, index, start=None, end=None):
+    # (time, stream index, loss, series size) of every closed series, read in blocks of rows
+    state = SeriesState()
+    columns = stream.columns
+    level = stream.drawdown_level
+    for offset in range(0, len(columns), ROW_BLOCK):
+        rows = columns[offset:offset + ROW_BLOCK][['time', 'volume', 'profit', 'balance']].tolist()
+        for series in iter_series(rows, state):
+            if start is not None and series.time < start:
+                continue
+            if end is not None and series.time > end:
+                return
+            yield series.time, index, series_loss(series, level) * stream.weight, series.size
+
+
+def merged_deals(streams, start_date=None, end_date=None):
+    # k-way merge on (time, stream index): deals at the same second keep the order of the streams
+    start = date_to_epoch(start_date)
+    end = date_to_epoch(end_date)
+    return heapq.merge(*(stream_deals(stream, index, start, end) for index, stream in enumerate(streams)))
+
+
+def iter_portfolio(streams, initial_balance, multiplier, risk_manage=None, profit_mining=None, start_date=None, end_date=None,
+                   chunk_size=CHUNK, use_jit=None):
+    # Yields recalculate_balance_arrays-like results for consecutive chunks of the merged deals,
+    # with a 'stream' column and 'offset' (index of the chunk's first deal in the whole portfolio)
+    risk_manage = risk_tiers(risk_manage)
+    profit_mining = mining_tiers(profit_mining)
+    deals = merged_deals(streams, start_date, end_date)
+    state = None
+    offset = 0
+
+    while True:
+        chunk = list(zip(*(deal for _, deal in zip(range(chunk_size), deals))))
+        if not chunk:
+            return
+        times, stream_index, losses, series_size = chunk
+        result = run_balance_kernel(np.array(losses, dtype=np.float64), initial_balance, multiplier, risk_manage, profit_mining,
+                                    use_jit, state)
+        result['times'] = np.array(times, dtype=np.int64)
+        result['series_size'] = np.array(series_size, dtype=np.int64)
+        result['stream'] = np.array(stream_index, dtype=np.int32)
+        result['offset'] = offset
+        state = (final_balance(result), result['deposits'], result['withdrawals'])
+        offset += len(losses)
+        yield result
+
+
+class PortfolioSummary:
+    # summarize_result over a stream of chunks, without keeping the chunks
+    def __init__(self, initial_balance, names):
+        self.initial_balance = initial_balance
+        self.names = names
+        self.final_balance = initial_balance
+        self.total_income = 0.0
+        self.deposits = 0
+        self.deposited = 0.0
+        self.withdrawals = 0
+        self.withdrawn = 0.0
+        self.deals = 0
+        self.flows = 0.0
+        self.peak = float(initial_balance)
+        self.max_drawdown = 0.0
+        self.stream_deals = np.zeros(len(names), dtype=np.int64)
+        self.stream_profit = np.zeros(len(names), dtype=np.float64)
+
+    def add(self, result):
+        count = len(result['balance'])
+        self.final_balance = final_balance(result)
+        self.total_income += float(np.trunc(result['mining']).sum())
+        deposits = result['event_type'] == DEPOSIT
+        withdrawals = result['event_type'] == WITHDRAWAL
+        self.deposits += int(deposits.sum())
+        self.withdrawals += int(withdrawals.sum())
+        self.deposited += float(result['event_amount'][deposits].sum())
+        self.withdrawn -= float(result['event_amount'][withdrawals].sum())
+        self.deals += count
+
+        # Same equity as balance_engine.max_drawdown, with cash flows and the peak carried between chunks
+        cash_flow = np.zeros(count, dtype=np.float64)
+        np.add.at(cash_flow, result['event_index'], result['event_amount'])
+        flows = np.cumsum(cash_flow)
+        equity = result['balance'] - (self.flows + np.concatenate(([0.0], flows[:-1])))
+        peaks = np.maximum(np.maximum.accumulate(equity), self.peak)
+        self.max_drawdown = max(self.max_drawdown, float(np.max(peaks - equity)))
+        self.peak = float(peaks[-1])
+        self.flows += float(flows[-1])
+
+        self.stream_deals += np.bincount(result['stream'], minlength=len(self.names))
+        self.stream_profit += np.bincount(result['stream'], weights=result['profit'], minlength=len(self.names))
+
+    def as_dict(self):
+        return {
+            'final_balance': self.final_balance,
+            'total_income': self.total_income,
+            'deposits': self.deposits,
+            'deposited': self.deposited,
+            'withdrawals': self.withdrawals,
+            'withdrawn': self.withdrawn,
+            'max_drawdown': self.max_drawdown,
+            'deals': self.deals,
+        }
+
+    def streams_frame(self):
+        # Contribution of every report to the shared balance
+        return pd.DataFrame({'report': self.names, 'deals': self.stream_deals, 'profit': self.stream_profit})
+
+
+def concat_chunks(chunks):
+    # Chunk results -> one result in the recalculate_balance_arrays layout, event indices made global
+    chunks = list(chunks)
+    if not chunks:
+        return None
+    result = {name: np.concatenate([chunk[name] for chunk in chunks])
+              for name in ('profit', 'balance', 'multiplier', 'mining', 'event_type', 'event_amount', 'event_balance',
+                           'times', 'series_size', 'stream')}
+    result['event_index'] = np.concatenate([chunk['event_index'] + chunk['offset'] for chunk in chunks])
+    result['deposits'] = chunks[-1]['deposits']
+    result['withdrawals'] = chunks[-1]['withdrawals']
+    return result
+
+
+def simulate_portfolio(streams, initial_balance, multiplier=None, risk_manage=None, profit_mining=None, start_date=None, end_date=None,
+                       keep_history=False, chunk_size=CHUNK, use_jit=None):
+    # Returns (PortfolioSummary, full result or None); keep_history=True keeps every chunk for export and plots
+    multiplier = initial_balance if multiplier is None else multiplier
+    summary = PortfolioSummary(initial_balance, [stream.name for stream in streams])
+    chunks = []
+    for chunk in iter_portfolio(streams, initial_balance, multiplier, risk_manage, profit_mining, start_date, end_date, chunk_size, use_jit):
+        summary.add(chunk)
+        if keep_history:
+            chunks.append(chunk)
+    return summary, concat_chunks(chunks) if keep_history else None
+
+
+def load_streams(reports, drawdown_levels, weights=None):
+    # Deal columns come memory-mapped from the deal cache, the reports are parsed only once
+    weights = weights or [1.0] * len(reports)
+    return [Stream(report, load_deal_columns(report), level, weight) for report, level, weight in zip(reports, drawdown_levels, weights)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Несколько отчетов на одном счете с общим балансом')
+    parser.add_argument('reports', nargs='+', help='HTML отчеты тестера MT5')
+    parser.add_argument('--initial-balance', type=float, default=1000)
+    parser.add_argument('--multiplier', type=float, help='По умолчанию равен initial_balance')
+    parser.add_argument('--drawdown-levels', default='9', help='Один уровень для всех отчетов или по уровню на отчет через запятую')
+    parser.add_argument('--weights', help='Множители лота отчетов через запятую')
+    parser.add_argument('--start-date', default=START_DATE)
+    parser.add_argument('--end-date', default=END_DATE)
+    args = parser.parse_args()
+
+    levels = [int(value) for value in args.drawdown_levels.split(',')]
+    levels = levels * len(args.reports) if len(levels) == 1 else levels
+    weights = [float(value) for value in args.weights.split(',')] if args.weights else None
+    if len(levels) != len(args.reports) or (weights and len(weights) != len(args.reports)):
+        parser.error('--drawdown-levels и --weights задаются по одному значению на отчет')
+
+    streams = load_streams(args.reports, levels, weights)
+    summary, _ = simulate_portfolio(streams, args.initial_balance, args.multiplier, RISK_MANAGE, PROFIT_MINING, args.start_date, args.end_date)
+    for key, value in summary.as_dict().items():
+        print(f'{key}: {value}')
+    print(summary.streams_frame().to_string())
+
+
+if __name__ == '__main__':
+    main()
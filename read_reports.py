@@ -1,7 +1,17 @@
+from html.parser import HTMLParser
+
 from bs4 import BeautifulSoup
 
 
-def parse_html(file_name):
+DEALS_HEADER = 'Сделки'
+DEAL_ROW_COLOR = '#FFFFFF'
+
+
+def parse_html(file_name, streaming=False):
+    # The streaming mode returns the same records without building the whole document tree
+    if streaming:
+        return list(iter_deals(file_name))
+
     with open(file_name, 'r', encoding='utf-16-le') as file:
         content = file.read()
 
@@ -12,11 +22,11 @@ def parse_html(file_name):
     headers = []
 
     for tr in trs:
-        if tr.get('bgcolor') == '#FFFFFF' and deal_found:
+        if tr.get('bgcolor') == DEAL_ROW_COLOR and deal_found:
             deal_rows.append(tr)
 
         th = tr.find('th')
-        if th and th.text.strip() == 'Сделки':
+        if th and th.text.strip() == DEALS_HEADER:
             deal_found = True
             headers = [th.text.strip() for th in tr.find_next('tr').find_all('td')]
 
@@ -29,3 +39,89 @@ def parse_html(file_name):
         deals.append(deal)
 
     return deals
+
+
+class DealRowsParser(HTMLParser):
+    # Incremental row scanner: keeps only the current row in memory and
+    # puts finished deal dicts into self.deals for the caller to drain
+    def __init__(self):
+        super().__init__()
+        self.deals = []
+        self.headers = None
+        self.deal_found = False
+        self.wait_headers = False
+        self.row = None
+        self.row_color = None
+        self.row_th = None
+        self.cell = None
+        self.in_th = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'tr':
+            self.finish_row()
+            self.row = []
+            self.row_color = dict(attrs).get('bgcolor')
+            self.row_th = None
+        elif self.row is None:
+            return
+        elif tag == 'td':
+            self.finish_cell()
+            self.cell = []
+        elif tag == 'th' and self.row_th is None:
+            self.finish_cell()
+            self.row_th = []
+            self.in_th = True
+
+    def handle_endtag(self, tag):
+        if tag == 'tr':
+            self.finish_row()
+        elif tag == 'td':
+            self.finish_cell()
+        elif tag == 'th':
+            self.in_th = False
+
+    def handle_data(self, data):
+        if self.cell is not None:
+            self.cell.append(data)
+        if self.in_th:
+            self.row_th.append(data)
+
+    def finish_cell(self):
+        if self.cell is not None:
+            self.row.append(''.join(self.cell).strip())
+            self.cell = None
+
+    def finish_row(self):
+        if self.row is None:
+            return
+        self.finish_cell()
+        self.in_th = False
+
+        if self.wait_headers:
+            self.headers = self.row
+            self.wait_headers = False
+        elif self.row_color == DEAL_ROW_COLOR and self.deal_found:
+            self.deals.append(dict(zip(self.headers, self.row)))
+
+        if self.row_th is not None and ''.join(self.row_th).strip() == DEALS_HEADER:
+            self.deal_found = True
+            self.wait_headers = True
+
+        self.row = None
+
+
+def iter_deals(file_name, chunk_size=1 << 16):
+    # Read the report in chunks and yield deal dicts as soon as their rows are closed
+    parser = DealRowsParser()
+    with open(file_name, 'r', encoding='utf-16-le') as file:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            parser.feed(chunk)
+            yield from parser.deals
+            parser.deals.clear()
+
+    parser.close()
+    parser.finish_row()
+    yield from parser.deals
@@ -0,0 +1,180 @@
+import os
+import json
+import time
+import hashlib
+import numpy as np
+
+from deal_cache import CACHE_DIR, write_atomic
+from balance_engine import recalculate_balance_arrays
+from tiers import TierTable
+from timestamps import date_to_epoch
+
+
+RESULT_CACHE_DIR = os.path.join(CACHE_DIR, 'results')
+RESULT_CACHE_VERSION = 1
+MAX_BYTES = 512 << 20
+MAX_ENTRIES = 1024
+# Temporary files of write_atomic older than this were left by a killed run, not by a write in progress
+STALE_TMP_SECONDS = 3600
+
+# Scalars of a recalculate_balance_arrays result; everything else is an array
+SCALAR_FIELDS = ('deposits', 'withdrawals')
+
+
+def arrays_fingerprint(arrays):
+    # Content hash of the deal arrays (SeriesTable.arrays() / deal_arrays), independent of the report path
+    digest = hashlib.sha1()
+    for name in sorted(arrays):
+        array = np.ascontiguousarray(arrays[name])
+        digest.update(f'{name}:{array.dtype.str}:{array.shape};'.encode('utf-8'))
+        digest.update(memoryview(array).cast('B'))
+    return digest.hexdigest()
+
+
+def tier_key(tiers):
+    if tiers is None:
+        return None
+    table = TierTable(tiers, require_zero=False)
+    return [list(pair) for pair in zip(table.levels, table.percents)]
+
+
+def result_key(fingerprint, initial_balance, drawdown_level, start_date, end_date, multiplier, risk_manage, profit_mining):
+    # Dates are compared as epoch seconds and tiers as sorted (level, percent) floats,
+    # so '01.01.2014' and datetime(2014, 1, 1) or {0: 100} and {0.0: 100.0} hit the same entry
+    params = {
+        'version': RESULT_CACHE_VERSION,
+        'deals': fingerprint,
+        'initial_balance': float(initial_balance),
+        'drawdown_level': int(drawdown_level),
+        'start': date_to_epoch(start_date),
+        'end': date_to_epoch(end_date),
+        'multiplier': float(multiplier),
+        'risk_manage': tier_key(risk_manage),
+        'profit_mining': tier_key(profit_mining),
+    }
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    # On-disk recalculate_balance_arrays results, one .npz per parameter set. Least recently used
+    # entries (by mtime, refreshed on every hit) are evicted above max_bytes or max_entries.
+    def __init__(self, cache_dir=RESULT_CACHE_DIR, max_bytes=MAX_BYTES, max_entries=MAX_ENTRIES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.last_fingerprint = None  # (arrays, fingerprint) of the last arrays only, older ones are not kept alive
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def fingerprint(self, arrays):
+        # Consecutive calls with the same arrays dict hash it once
+        if self.last_fingerprint is None or self.last_fingerprint[0] is not arrays:
+            self.last_fingerprint = (arrays, arrays_fingerprint(arrays))
+        return self.last_fingerprint[1]
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with np.load(path) as data:
+                result = {name: data[name] for name in data.files}
+            os.utime(path)
+        except (OSError, ValueError):
+            # Missing, unreadable or evicted by another process
+            self.misses += 1
+            return None
+        for name in SCALAR_FIELDS:
+            result[name] = result[name].item()
+        self.hits += 1
+        return result
+
+    def put(self, key, result):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        write_atomic(self.path(key), lambda file: np.savez(file, **result))
+        self.evict()
+
+    def entries(self):
+        # (mtime, size, path) of every entry, oldest first
+        if not os.path.isdir(self.cache_dir):
+            return []
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.npz'):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, path))
+        return sorted(entries)
+
+    def temporary_files(self, min_age=0):
+        # .npz.tmp files of write_atomic, a run killed while writing leaves one behind
+        if not os.path.isdir(self.cache_dir):
+            return []
+        now = time.time()
+        paths = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.npz.tmp'):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    if now - os.stat(path).st_mtime >= min_age:
+                        paths.append(path)
+                except OSError:
+                    continue
+        return paths
+
+    def remove_temporary(self, min_age=0):
+        for path in self.temporary_files(min_age):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def evict(self):
+        self.remove_temporary(STALE_TMP_SECONDS)
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        while entries and (total > self.max_bytes or len(entries) > self.max_entries):
+            _, size, path = entries.pop(0)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+            self.evictions += 1
+
+    def clear(self):
+        for _, _, path in self.entries():
+            os.remove(path)
+        self.remove_temporary()
+
+    def recalculate(self, arrays, initial_balance, drawdown_level, start_date=None, end_date=None, multiplier=3000, risk_manage=None, profit_mining=None):
+        # Drop-in for recalculate_balance_arrays
+        key = result_key(self.fingerprint(arrays), initial_balance, drawdown_level, start_date, end_date, multiplier, risk_manage, profit_mining)
+        result = self.get(key)
+        if result is None:
+            result = recalculate_balance_arrays(arrays, initial_balance, drawdown_level, start_date, end_date, multiplier, risk_manage, profit_mining)
+            self.put(key, result)
+        return result
+
+    def stats(self):
+        entries = self.entries()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else None,
+            'evictions': self.evictions,
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+        }
+
+    def print_stats(self):
+        stats = self.stats()
+        hit_rate = f"{stats['hit_rate']:.0%}" if stats['hit_rate'] is not None else '-'
+        print(f"Кэш результатов: попаданий {stats['hits']}, промахов {stats['misses']} ({hit_rate}), "
+              f"вытеснено {stats['evictions']}, записей {stats['entries']}, {stats['bytes'] // 1024} KB")
@@ -0,0 +1,170 @@
+import os
+import json
+import argparse
+import itertools
+from multiprocessing import Pool, shared_memory
+import numpy as np
+import pandas as pd
+
+from deal_cache import load_deal_columns
+from deal_series import SeriesTable
+from balance_engine import recalculate_balance_arrays, summarize_result
+from export import export_frame
+from main_calculator import RISK_MANAGE, PROFIT_MINING, START_DATE, END_DATE
+
+
+# Deal arrays attached from shared memory, set once per worker process
+worker_arrays = None
+worker_blocks = []
+
+
+def share_arrays(arrays):
+    # Copy every array into its own shared memory block; workers get only names, shapes and dtypes
+    blocks = []
+    specs = {}
+    for name, array in arrays.items():
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        specs[name] = (block.name, array.shape, array.dtype.str)
+    return blocks, specs
+
+
+def attach_arrays(specs):
+    blocks = []
+    arrays = {}
+    for name, (block_name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        array.flags.writeable = False
+        blocks.append(block)
+        arrays[name] = array
+    return blocks, arrays
+
+
+def release_blocks(blocks):
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+
+def init_worker(specs):
+    global worker_arrays, worker_blocks
+    worker_blocks, worker_arrays = attach_arrays(specs)
+
+
+def named_tiers(tiers):
+    # Tier grids may be given as a list or as {name: tiers}; the result table shows the names
+    if tiers is None:
+        return {'none': None}
+    if isinstance(tiers, dict):
+        return tiers
+    return {str(i): value for i, value in enumerate(tiers)}
+
+
+def param_grid(initial_balances, drawdown_levels, risk_manages=None, profit_minings=None, multipliers=None):
+    # multipliers=None keeps the chek_calculates convention: multiplier equals initial_balance
+    risk_manages = named_tiers(risk_manages)
+    profit_minings = named_tiers(profit_minings)
+    grid = []
+    for initial_balance, drawdown_level, risk_name, mining_name in itertools.product(
+            initial_balances, drawdown_levels, risk_manages, profit_minings):
+        for multiplier in (multipliers or [initial_balance]):
+            grid.append({
+                'initial_balance': initial_balance,
+                'drawdown_level': drawdown_level,
+                'multiplier': multiplier,
+                'risk_manage': risk_name,
+                'profit_mining': mining_name,
+                'risk_manage_tiers': risk_manages[risk_name],
+                'profit_mining_tiers': profit_minings[mining_name],
+            })
+    return grid
+
+
+def evaluate_params(arrays, params, start_date, end_date):
+    result = recalculate_balance_arrays(arrays, params['initial_balance'], params['drawdown_level'], start_date, end_date,
+                                        params['multiplier'], params['risk_manage_tiers'], params['profit_mining_tiers'])
+    row = {key: value for key, value in params.items() if not key.endswith('_tiers')}
+    row.update(summarize_result(result, params['initial_balance']))
+    return row
+
+
+def evaluate_task(task):
+    params, start_date, end_date = task
+    return evaluate_params(worker_arrays, params, start_date, end_date)
+
+
+def run_sweep(arrays, grid, start_date=START_DATE, end_date=END_DATE, processes=None, objective='final_balance', ascending=False, chunksize=None):
+    # Deal arrays go to the workers once through shared memory, tasks carry only the parameters
+    tasks = [(params, start_date, end_date) for params in grid]
+    if processes == 1:
+        rows = [evaluate_params(arrays, params, start_date, end_date) for params in grid]
+    else:
+        blocks, specs = share_arrays(arrays)
+        try:
+            processes = processes or os.cpu_count()
+            chunksize = chunksize or max(1, len(tasks) // (processes * 8))
+            with Pool(processes, initializer=init_worker, initargs=(specs,)) as pool:
+                rows = pool.map(evaluate_task, tasks, chunksize=chunksize)
+        finally:
+            release_blocks(blocks)
+
+    table = pd.DataFrame(rows)
+    if len(table):
+        table = table.sort_values(objective, ascending=ascending, kind='stable').reset_index(drop=True)
+    return table
+
+
+def parse_values(text, cast=int):
+    # '500,1000' or '8-12' or '500-4000:500'
+    values = []
+    for part in text.split(','):
+        if '-' in part:
+            bounds, _, step = part.partition(':')
+            first, last = bounds.split('-')
+            values.extend(range(cast(first), cast(last) + 1, cast(step or 1)))
+        else:
+            values.append(cast(part))
+    return values
+
+
+def load_tiers(file_name):
+    # JSON file: {"risk_manage": {"name": {"0": 100, ...}}, "profit_mining": {...}}
+    with open(file_name, 'r', encoding='utf-8') as file:
+        data = json.load(file)
+
+    def convert(tiers):
+        return {name: None if value is None else {float(level): percent for level, percent in value.items()}
+                for name, value in tiers.items()}
+
+    return convert(data.get('risk_manage', {'base': RISK_MANAGE})), convert(data.get('profit_mining', {'base': PROFIT_MINING}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Перебор параметров initial_balance / drawdown_level / уровней риска')
+    parser.add_argument('report', help='HTML отчет тестера MT5')
+    parser.add_argument('--initial-balances', default='500,1000,2000,4000')
+    parser.add_argument('--drawdown-levels', default='8-11')
+    parser.add_argument('--tiers', help='JSON с наборами risk_manage и profit_mining')
+    parser.add_argument('--start-date', default=START_DATE)
+    parser.add_argument('--end-date', default=END_DATE)
+    parser.add_argument('--processes', type=int)
+    parser.add_argument('--objective', default='final_balance')
+    parser.add_argument('--ascending', action='store_true')
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--output', help='Сохранить всю таблицу результатов (.csv, .parquet, .feather, .xlsx)')
+    args = parser.parse_args()
+
+    risk_manages, profit_minings = load_tiers(args.tiers) if args.tiers else ({'base': RISK_MANAGE}, {'base': PROFIT_MINING})
+    grid = param_grid(parse_values(args.initial_balances), parse_values(args.drawdown_levels), risk_manages, profit_minings)
+    arrays = SeriesTable.from_columns(load_deal_columns(args.report)).arrays()
+
+    table = run_sweep(arrays, grid, args.start_date, args.end_date, args.processes, args.objective, args.ascending)
+    print(table.head(args.top).to_string())
+    if args.output:
+        export_frame(table, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+import os
+import sys
+import math
+from datetime import datetime, timedelta
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from read_reports import parse_html
+from deal_cache import load_deal_columns
+from deal_series import SeriesTable
+from balance_engine import recalculate_balance_arrays, to_balance_history, deal_losses, series_loss
+from balance_kernel import HAS_NUMBA, run_balance_kernel
+from timestamps import format_time
+from main_calculator import RISK_MANAGE, PROFIT_MINING, START_DATE, END_DATE
+
+
+REPORTS = ['files/reports/ReportTester-GBP_H1.html', 'files/reports/history.html']
+CALC_PARAMS = [(500, 8), (1000, 9), (2000, 10), (4000, 11)]
+
+
+# process_deals and recalculate_balance as they were before the engine was introduced; they are the
+# oracle the engine has to reproduce record for record, whatever main_calculator looks like now
+
+def legacy_risk_split(balance, risk_manage):
+    if risk_manage is None:
+        return 1, balance, 0
+    for level in sorted(risk_manage.keys(), reverse=True):
+        if balance >= level:
+            risk_percent = risk_manage[level] / 100
+            risky_balance = balance * risk_percent
+            return risk_percent, risky_balance, balance - risky_balance
+
+
+def legacy_process_deals(deals):
+    processed_deals = []
+    drawdown = 0
+    series_length = 0
+    drawdown_levels = {}
+    series_start_balance = None
+    deals.pop(0)
+
+    for deal in deals:
+        profit = float(deal['Прибыль'].replace(' ', ''))
+        balance = float(deal['Баланс'].replace(' ', ''))
+        if series_start_balance is None or drawdown == 0:
+            series_start_balance = balance - profit
+        balance_change = balance - series_start_balance
+
+        if profit > 0:
+            if drawdown < 0:
+                processed_deals.append({'Время': deal['Время'], 'Прибыль': balance_change,
+                                        'Размер серии': series_length + 1, 'Уровни просадки': drawdown_levels})
+                drawdown = 0
+                series_length = 0
+                drawdown_levels = {}
+            else:
+                processed_deals.append({'Время': deal['Время'], 'Прибыль': balance_change,
+                                        'Размер серии': 1, 'Уровни просадки': {}})
+        else:
+            drawdown += profit
+            series_length += 1
+            drawdown_levels[series_length] = drawdown
+    return processed_deals
+
+
+def legacy_recalculate_balance(processed_deals, initial_balance, drawdown_level, start_date=None, end_date=None, multiplier=3000,
+                               risk_manage=None, profit_mining=None):
+    first_deposit = initial_balance
+    balance = initial_balance
+    balance_history = []
+    withdrawals = 0
+    deposits = 1
+    start_date = datetime.strptime(start_date, '%d.%m.%Y') if start_date is not None else None
+    end_date = datetime.strptime(end_date, '%d.%m.%Y') if end_date is not None else None
+
+    for deal in processed_deals:
+        deal_date = datetime.strptime(deal['Время'], '%Y.%m.%d %H:%M:%S')
+        if start_date is not None and deal_date < start_date:
+            continue
+        if end_date is not None and deal_date > end_date:
+            continue
+
+        if deal['Размер серии'] > drawdown_level:
+            loss = deal['Уровни просадки'].get(drawdown_level, 0)
+        else:
+            loss = deal['Прибыль']
+
+        risk_percent, risky_balance, buffer_balance = legacy_risk_split(balance, risk_manage)
+        balance_ratio = max(math.floor(risky_balance / multiplier), 1)
+        loss *= balance_ratio
+        last_positive_balance = risky_balance
+        risky_balance += loss
+        balance_change = loss
+        if risky_balance < 0:
+            balance_change = -last_positive_balance
+            risky_balance = 0
+        balance = risky_balance + buffer_balance
+
+        profit_mining_deduction = 0
+        if profit_mining is not None:
+            for level in sorted(profit_mining.keys(), reverse=True):
+                if balance >= level and balance_change > 0:
+                    profit_mining_deduction = balance_change * profit_mining[level] / 100
+                    balance_change -= profit_mining_deduction
+                    balance -= profit_mining_deduction
+                    break
+
+        balance_history.append({'Время': deal['Время'], 'Прибыль': balance_change, 'Баланс': balance,
+                                'Размер серии': deal['Размер серии'], 'Множитель': balance_ratio, 'Тип': 'сделка',
+                                'Сбор дохода': profit_mining_deduction})
+
+        event_date = (deal_date + timedelta(seconds=5)).strftime('%Y.%m.%d %H:%M:%S')
+        if balance < first_deposit:
+            deposit_amount = first_deposit - balance
+            balance += deposit_amount
+            deposits += 1
+            balance_history.append({'Время': event_date, 'Прибыль': deposit_amount, 'Баланс': balance,
+                                    'Размер серии': 0, 'Множитель': 0, 'Тип': 'пополнение', 'Сбор дохода': 0})
+
+        if balance >= ((multiplier * 2) + first_deposit) and withdrawals < deposits:
+            balance -= first_deposit
+            withdrawals += 1
+            balance_history.append({'Время': event_date, 'Прибыль': -first_deposit, 'Баланс': balance,
+                                    'Размер серии': 0, 'Множитель': 0, 'Тип': 'снятие средств', 'Сбор дохода': 0})
+    return balance_history
+
+
+@pytest.fixture(scope='module', params=REPORTS)
+def report(request, tmp_path_factory):
+    # (legacy processed deals, engine arrays) of one report; the deal cache goes to a temporary directory
+    file_name = os.path.join(ROOT, request.param)
+    processed_deals = legacy_process_deals(parse_html(file_name))
+    columns = load_deal_columns(file_name, cache_dir=str(tmp_path_factory.mktemp('cache')))
+    return processed_deals, SeriesTable.from_columns(columns).arrays()
+
+
+@pytest.mark.parametrize('initial_balance, drawdown_level', CALC_PARAMS)
+def test_engine_matches_legacy_loop(report, initial_balance, drawdown_level):
+    processed_deals, arrays = report
+    args = (initial_balance, drawdown_level, START_DATE, END_DATE, initial_balance, RISK_MANAGE, PROFIT_MINING)
+    expected = legacy_recalculate_balance(processed_deals, *args)
+
+    actual = to_balance_history(recalculate_balance_arrays(arrays, *args)).to_dicts()
+    for record in actual:
+        record['Время'] = format_time(record['Время'])
+    assert len(actual) == len(expected)
+    assert actual == expected
+
+
+@pytest.mark.skipif(not HAS_NUMBA, reason='numba is not installed')
+@pytest.mark.parametrize('risk_manage, profit_mining', [(None, None), (RISK_MANAGE, PROFIT_MINING)])
+def test_kernel_jit_matches_python(risk_manage, profit_mining):
+    # Same synthetic series results as benchmarks/bench_balance.py kernel_throughput
+    rng = np.random.default_rng(0)
+    count = 200_000
+    losses = np.where(rng.random(count) < 0.8, rng.uniform(5, 10, count), -rng.uniform(10, 80, count))
+    compiled = run_balance_kernel(losses, 1000, 1000, risk_manage, profit_mining, use_jit=True)
+    python = run_balance_kernel(losses, 1000, 1000, risk_manage, profit_mining, use_jit=False)
+
+    assert compiled.keys() == python.keys()
+    assert len(compiled['event_index'])
+    for name, value in python.items():
+        if isinstance(value, np.ndarray):
+            assert compiled[name].dtype == value.dtype, name
+            assert np.array_equal(compiled[name], value), name
+        else:
+            assert compiled[name] == value, name
+
+
+@pytest.mark.parametrize('drawdown_level', [0, 1, 8, 11, 40])
+def test_series_loss_matches_deal_losses(drawdown_level, tmp_path):
+    # The per-series rule of portfolio and watch must stay the vectorized rule of the engine
+    columns = load_deal_columns(os.path.join(ROOT, REPORTS[0]), cache_dir=str(tmp_path))
+    table = SeriesTable.from_columns(columns)
+    expected = deal_losses(table.arrays(), drawdown_level)
+    assert [series_loss(series, drawdown_level) for series in table] == expected.tolist()
@@ -0,0 +1,77 @@
+import os
+import sys
+import shutil
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from deal_cache import load_deal_columns
+from deal_series import SeriesTable
+from balance_engine import recalculate_balance_arrays, final_balance
+from watch import LiveAccount, LiveSession
+from main_calculator import RISK_MANAGE, PROFIT_MINING
+
+
+REPORT = os.path.join(ROOT, 'files/reports/ReportTester-GBP_H1.html')
+OTHER_REPORT = os.path.join(ROOT, 'files/reports/history.html')
+DEAL_ROW = '<tr bgcolor="#FFFFFF"'
+
+
+def cut_report(source, target, deals):
+    # The report as the tester would have exported it after `deals` deals: rows up to that deal plus the
+    # closing markup (totals row, </table>, ...) that follows the last deal row
+    with open(source, 'r', encoding='utf-16-le', newline='') as file:
+        text = file.read()
+    position = text.index('Сделки')
+    for _ in range(deals):
+        position = text.index(DEAL_ROW, position) + len(DEAL_ROW)
+    row_end = text.index('</tr>', position) + len('</tr>')
+    last_row_end = text.index('</tr>', text.rindex(DEAL_ROW)) + len('</tr>')
+    with open(target, 'w', encoding='utf-16-le', newline='') as file:
+        file.write(text[:row_end] + text[last_row_end:])
+
+
+def replace_file(source, target):
+    # A re-export: new content and a new mtime, whatever the resolution of the file system clock
+    shutil.copyfile(source, target)
+    stat = os.stat(target)
+    os.utime(target, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def engine_final_balance(report, tmp_path):
+    arrays = SeriesTable.from_columns(load_deal_columns(report, cache_dir=str(tmp_path / 'cache'))).arrays()
+    return len(arrays['times']), final_balance(recalculate_balance_arrays(arrays, 1000, 9, None, None, 1000, RISK_MANAGE, PROFIT_MINING))
+
+
+def new_session(file_name):
+    return LiveSession(file_name, [LiveAccount('live', 1000, 9, None, RISK_MANAGE, PROFIT_MINING)])
+
+
+def test_reexported_report_continues_after_seen_deals(tmp_path):
+    live_file = str(tmp_path / 'report.html')
+    cut_report(REPORT, live_file, 600)
+    session = new_session(live_file)
+    first = len(session.update())
+
+    replace_file(REPORT, live_file)
+    second = len(session.update())
+    assert session.update() == []
+
+    series, balance = engine_final_balance(REPORT, tmp_path)
+    assert first and second
+    assert first + second == series
+    assert session.accounts[0].summary.final_balance == pytest.approx(balance)
+
+
+def test_report_replaced_by_another_starts_over(tmp_path):
+    live_file = str(tmp_path / 'report.html')
+    cut_report(REPORT, live_file, 600)
+    session = new_session(live_file)
+    session.update()
+
+    replace_file(OTHER_REPORT, live_file)
+    series, balance = engine_final_balance(OTHER_REPORT, tmp_path)
+    assert len(session.update()) == series
+    assert session.accounts[0].summary.deals == series
+    assert session.accounts[0].summary.final_balance == pytest.approx(balance)
@@ -0,0 +1,77 @@
+from bisect import bisect_right
+import numpy as np
+
+
+class TierTable:
+    # Immutable {balance threshold: percent} table compiled once; a balance uses the highest threshold <= balance
+    __slots__ = ('levels', 'percents', 'levels_array', 'percents_array')
+
+    def __init__(self, tiers, require_zero=True, name='tiers'):
+        if isinstance(tiers, TierTable):
+            tiers = tiers.as_dict()
+        if not tiers:
+            raise ValueError(f'{name} must contain at least one level')
+        levels = sorted(float(level) for level in tiers.keys())
+        percents = [float(tiers[level]) for level in sorted(tiers.keys())]
+        if require_zero and levels[0] > 0:
+            raise ValueError(f'{name} must cover zero balance, the lowest level is {levels[0]}')
+        negative = [level for level, percent in zip(levels, percents) if percent < 0]
+        if negative:
+            raise ValueError(f'{name} has negative percents at levels {negative}')
+
+        levels_array = np.array(levels, dtype=np.float64)
+        percents_array = np.array(percents, dtype=np.float64)
+        levels_array.flags.writeable = False
+        percents_array.flags.writeable = False
+
+        object.__setattr__(self, 'levels', tuple(levels))
+        object.__setattr__(self, 'percents', tuple(percents))
+        object.__setattr__(self, 'levels_array', levels_array)
+        object.__setattr__(self, 'percents_array', percents_array)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('TierTable is immutable')
+
+    def __eq__(self, other):
+        return isinstance(other, TierTable) and self.levels == other.levels and self.percents == other.percents
+
+    def __hash__(self):
+        return hash((self.levels, self.percents))
+
+    def __repr__(self):
+        return f'TierTable({self.as_dict()})'
+
+    def __len__(self):
+        return len(self.levels)
+
+    def as_dict(self):
+        return dict(zip(self.levels, self.percents))
+
+    def index(self, balance):
+        # -1 when the balance is below the lowest level
+        return bisect_right(self.levels, balance) - 1
+
+    def percent(self, balance, default=None):
+        tier = bisect_right(self.levels, balance) - 1
+        return self.percents[tier] if tier >= 0 else default
+
+    def bulk_index(self, balances):
+        return np.searchsorted(self.levels_array, balances, side='right') - 1
+
+    def bulk_percent(self, balances, default=np.nan):
+        tier = self.bulk_index(balances)
+        return np.where(tier >= 0, self.percents_array[np.maximum(tier, 0)], default)
+
+
+def risk_tiers(risk_manage):
+    # risk_manage must cover zero: every balance needs a risk percent
+    if risk_manage is None or isinstance(risk_manage, TierTable):
+        return risk_manage
+    return TierTable(risk_manage, require_zero=True, name='risk_manage')
+
+
+def mining_tiers(profit_mining):
+    # profit_mining starts at its first threshold, below it nothing is collected
+    if profit_mining is None or isinstance(profit_mining, TierTable):
+        return profit_mining
+    return TierTable(profit_mining, require_zero=False, name='profit_mining')
@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+import numpy as np
+
+
+DEAL_TIME_FORMAT = '%Y.%m.%d %H:%M:%S'
+DATE_FORMAT = '%d.%m.%Y'
+EPOCH = datetime(1970, 1, 1)
+
+# Deal times live as int64 seconds since epoch everywhere; report times are naive and treated as UTC.
+# Strings are produced only for export (Excel, CSV) and for printing.
+
+
+def days_from_civil(year, month, day):
+    # Days since 1970-01-01 for a proleptic Gregorian date, integer arithmetic only
+    year -= month <= 2
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    return era * 146097 + day_of_era - 719468
+
+
+def parse_time(value):
+    # Fixed 'YYYY.MM.DD HH:MM:SS' layout is sliced directly, anything else goes through strptime
+    if len(value) != 19 or value[4] != '.' or value[7] != '.' or value[10] != ' ' or value[13] != ':' or value[16] != ':':
+        return int((datetime.strptime(value, DEAL_TIME_FORMAT) - EPOCH).total_seconds())
+    days = days_from_civil(int(value[0:4]), int(value[5:7]), int(value[8:10]))
+    return days * 86400 + int(value[11:13]) * 3600 + int(value[14:16]) * 60 + int(value[17:19])
+
+
+def parse_times(values):
+    # Vectorized parse_time for a whole column
+    values = np.asarray(values, dtype='U19')
+    if not len(values):
+        return np.empty(0, dtype=np.int64)
+    return np.char.replace(values, '.', '-').astype('datetime64[s]').astype(np.int64)
+
+
+def to_epoch(value):
+    # Deal time in any form that still shows up in records: epoch seconds, report string or datetime
+    if isinstance(value, str):
+        return parse_time(value)
+    if isinstance(value, datetime):
+        return int((value - EPOCH).total_seconds())
+    return int(value)
+
+
+def date_to_epoch(value):
+    # start_date / end_date arguments: 'DD.MM.YYYY', datetime or epoch seconds
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.strptime(value, DATE_FORMAT)
+    return to_epoch(value)
+
+
+def to_datetime(seconds):
+    return EPOCH + timedelta(seconds=int(seconds))
+
+
+def format_time(seconds):
+    return to_datetime(seconds).strftime(DEAL_TIME_FORMAT)
+
+
+def format_times(seconds):
+    # Vectorized format_time, used when a whole column is exported
+    text = np.asarray(seconds, dtype=np.int64).astype('datetime64[s]').astype('U19')
+    return np.char.replace(np.char.replace(text, '-', '.'), 'T', ' ')
@@ -0,0 +1,332 @@
+import os
+import csv
+import codecs
+import asyncio
+import argparse
+import numpy as np
+
+from read_reports import DealRowsParser
+from deal_series import SeriesState, deal_rows, iter_series
+from balance_kernel import DEPOSIT, WITHDRAWAL, run_balance_kernel
+from balance_engine import final_balance, series_loss
+from balance_history import history_columns
+from draw_plots import WEEK, draw_weekly_balance
+from portfolio import PortfolioSummary
+from tiers import risk_tiers, mining_tiers
+from timestamps import format_time
+from main_calculator import RISK_MANAGE, PROFIT_MINING
+
+
+# Live mode: the report (or a CSV deal export) is tailed, only appended rows are parsed, and
+# process_deals / recalculate_balance continue from the state kept after the previous rows.
+# Work per update depends on the number of new deals and touched weeks, not on the history length.
+
+
+class TailReader:
+    # Reads bytes appended after the consumed part of the file. Only bytes passed to commit() count as consumed:
+    # the rest is read again next time. A file that changed inside the consumed part (shorter, or a re-export
+    # with other bytes before the offset) was rewritten: its first and last WINDOW consumed bytes are
+    # compared on every change of size or mtime.
+    WINDOW = 4096
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.offset = 0
+        self.head = b''
+        self.tail = b''
+        self.stamp = None
+
+    def read_new(self):
+        try:
+            stat = os.stat(self.file_name)
+        except OSError:
+            return b''
+        stamp = (stat.st_size, stat.st_mtime_ns)
+        if stamp == self.stamp:
+            return b''
+        if stat.st_size < self.offset:
+            raise FileRewritten(self.file_name)
+        with open(self.file_name, 'rb') as file:
+            if not self.matches(file):
+                raise FileRewritten(self.file_name)
+            file.seek(self.offset)
+            data = file.read(stat.st_size - self.offset)
+        self.stamp = stamp
+        return data
+
+    def matches(self, file):
+        file.seek(0)
+        if file.read(len(self.head)) != self.head:
+            return False
+        file.seek(self.offset - len(self.tail))
+        return file.read(len(self.tail)) == self.tail
+
+    def commit(self, data):
+        # data: the bytes from self.offset on that are processed for good
+        if len(self.head) < self.WINDOW:
+            self.head = (self.head + data)[:self.WINDOW]
+        self.tail = (self.tail + data[-self.WINDOW:])[-self.WINDOW:]
+        self.offset += len(data)
+
+
+class FileRewritten(Exception):
+    pass
+
+
+class ReportTail(TailReader):
+    # MT5 tester report: UTF-16 LE HTML. Rows are fed once their </tr> has arrived, but the consumed part ends
+    # with the last deal row: the totals row and closing tags after it are read again, so a re-exported
+    # report with more deals continues right after the deals already seen.
+    def __init__(self, file_name):
+        super().__init__(file_name)
+        self.parser = DealRowsParser()
+        self.deals_seen = 0
+
+    def read_deals(self):
+        data = self.read_new()
+        if not data:
+            return []
+        text = codecs.getincrementaldecoder('utf-16-le')().decode(data)
+        position = committed = 0
+        while True:
+            end = text.find('</tr>', position)
+            if end < 0:
+                break
+            end += len('</tr>')
+            deals = len(self.parser.deals)
+            self.parser.feed(text[position:end])
+            position = end
+            # Rows before the first deal are consumed as they come, after it only deal rows move the offset
+            if not self.deals_seen or len(self.parser.deals) > deals:
+                committed = end
+                self.deals_seen += len(self.parser.deals) - deals
+        self.commit(text[:committed].encode('utf-16-le'))
+
+        deals = self.parser.deals
+        self.parser.deals = []
+        return deals
+
+
+class CsvTail(TailReader):
+    # Deal export with the report's column names in the header; only complete lines are parsed and consumed.
+    # Opening ('in') rows carry no result and are skipped like the coloured rows of the report.
+    def __init__(self, file_name):
+        super().__init__(file_name)
+        self.encoding = None
+        self.headers = None
+        self.delimiter = None
+
+    def read_deals(self):
+        data = self.read_new()
+        if not data:
+            return []
+        if self.encoding is None:
+            for bom, encoding in ((codecs.BOM_UTF16_LE, 'utf-16-le'), (codecs.BOM_UTF16_BE, 'utf-16-be'), (codecs.BOM_UTF8, 'utf-8')):
+                if data.startswith(bom):
+                    self.commit(bom)
+                    data = data[len(bom):]
+                    break
+            else:
+                encoding = 'utf-8'
+            self.encoding = encoding
+        text = codecs.getincrementaldecoder(self.encoding)().decode(data)
+        complete = text[:text.rfind('\n') + 1]
+        self.commit(complete.encode(self.encoding))
+        lines = [line.rstrip('\r') for line in complete.split('\n') if line.strip()]
+
+        if lines and self.headers is None:
+            self.delimiter = max(';\t,', key=lines[0].count)
+            self.headers = next(csv.reader([lines[0]], delimiter=self.delimiter))
+            lines = lines[1:]
+        deals = [dict(zip(self.headers, row)) for row in csv.reader(lines, delimiter=self.delimiter)]
+        return [deal for deal in deals if deal.get('Направление') != 'in']
+
+
+def open_tail(file_name):
+    return CsvTail(file_name) if os.path.splitext(file_name)[1].lower() in ('.csv', '.txt') else ReportTail(file_name)
+
+
+class WeeklyBalance:
+    # draw_plots.weekly_balance kept up to date chunk by chunk; only weeks touched by a chunk are recomputed.
+    # Week columns are buffers of doubling capacity, the first `weeks` entries are in use.
+    BUFFERS = ('finals', 'deposits', 'deposit_counts', 'withdrawals', 'withdrawal_counts')
+
+    def __init__(self, capacity=64):
+        self.base_time = None
+        self.first_deposit = None
+        self.weeks = 0
+        self.finals = np.zeros(capacity)
+        self.deposits = np.zeros(capacity)
+        self.deposit_counts = np.zeros(capacity, dtype=np.int64)
+        self.withdrawals = np.zeros(capacity)
+        self.withdrawal_counts = np.zeros(capacity, dtype=np.int64)
+
+    def grow(self, weeks):
+        # Amortized O(1) per new week: buffers are copied only when full, into twice the capacity
+        if weeks <= self.weeks:
+            return
+        if weeks > len(self.finals):
+            capacity = max(weeks, 2 * len(self.finals))
+            for name in self.BUFFERS:
+                buffer = getattr(self, name)
+                grown = np.zeros(capacity, dtype=buffer.dtype)
+                grown[:self.weeks] = buffer[:self.weeks]
+                setattr(self, name, grown)
+        # New weeks start with the last known balance
+        self.finals[self.weeks:weeks] = self.finals[self.weeks - 1] if self.weeks else 0.0
+        self.weeks = weeks
+
+    def add(self, times, balances, types, profits):
+        # Returns the range of weeks that changed
+        if not len(times):
+            return range(0)
+        if self.base_time is None:
+            self.base_time = int(times[0])
+            self.first_deposit = int(balances[0]) - int(profits[0])
+        week = (times - self.base_time) // WEEK
+        first_week = int(week[0])
+        self.grow(int(week[-1]) + 1)
+
+        # Last balance of every touched week, carried forward over weeks without records
+        last = np.flatnonzero(np.r_[week[1:] != week[:-1], True])
+        touched = np.zeros(self.weeks - first_week, dtype=bool)
+        touched[week[last] - first_week] = True
+        self.finals[week[last]] = balances[last]
+        carry = np.maximum.accumulate(np.where(touched, np.arange(len(touched)), 0)) + first_week
+        self.finals[first_week:self.weeks] = self.finals[carry]
+
+        deposit = types == DEPOSIT
+        withdrawal = types == WITHDRAWAL
+        np.add.at(self.deposits, week[deposit], balances[deposit])
+        np.add.at(self.deposit_counts, week[deposit], 1)
+        np.add.at(self.withdrawals, week[withdrawal], profits[withdrawal])
+        np.add.at(self.withdrawal_counts, week[withdrawal], 1)
+        return range(first_week, self.weeks)
+
+    def as_weekly(self):
+        weeks = self.weeks
+        return {
+            'base_time': self.base_time,
+            'first_deposit': self.first_deposit,
+            'finals': self.finals[:weeks],
+            'deposit_weeks': np.flatnonzero(self.deposit_counts[:weeks]),
+            'deposits': self.deposits[:weeks],
+            'withdrawal_weeks': np.flatnonzero(self.withdrawal_counts[:weeks]),
+            'withdrawals': self.withdrawals[:weeks],
+        }
+
+
+class LiveAccount:
+    # recalculate_balance for one parameter set, continued from the kept (balance, deposits, withdrawals)
+    def __init__(self, label, initial_balance, drawdown_level, multiplier=None, risk_manage=None, profit_mining=None):
+        self.label = label
+        self.initial_balance = initial_balance
+        self.drawdown_level = drawdown_level
+        self.multiplier = initial_balance if multiplier is None else multiplier
+        self.risk_manage = risk_tiers(risk_manage)
+        self.profit_mining = mining_tiers(profit_mining)
+        self.reset()
+
+    def reset(self):
+        # Back to a fresh account with the same parameters, e.g. after the file was rewritten
+        self.state = None
+        self.summary = PortfolioSummary(self.initial_balance, [self.label])
+        self.weekly = WeeklyBalance()
+        self.dirty = False
+
+    def add(self, series):
+        losses = np.array([series_loss(item, self.drawdown_level) for item in series], dtype=np.float64)
+        result = run_balance_kernel(losses, self.initial_balance, self.multiplier, self.risk_manage, self.profit_mining, state=self.state)
+        result['times'] = np.array([item.time for item in series], dtype=np.int64)
+        result['series_size'] = np.array([item.size for item in series], dtype=np.int64)
+        result['stream'] = np.zeros(len(series), dtype=np.int32)
+        self.state = (final_balance(result), result['deposits'], result['withdrawals'])
+        self.summary.add(result)
+
+        columns = history_columns(result)
+        self.weekly.add(columns['time'], columns['balance'], columns['type'], columns['profit'])
+        self.dirty = True
+        return result
+
+    def status(self):
+        summary = self.summary
+        return (f'{self.label}: баланс {summary.final_balance:.2f}, сделок {summary.deals}, '
+                f'пополнений {summary.deposits}, снятий {summary.withdrawals}, доход {summary.total_income:.0f}')
+
+
+class LiveSession:
+    def __init__(self, file_name, accounts):
+        self.file_name = file_name
+        self.accounts = accounts
+        self.reset()
+
+    def reset(self):
+        self.tail = open_tail(self.file_name)
+        self.series_state = SeriesState()
+        for account in self.accounts:
+            account.reset()
+
+    def update(self):
+        # New closed series since the last call, already applied to every account
+        try:
+            deals = self.tail.read_deals()
+        except FileRewritten:
+            self.reset()
+            deals = self.tail.read_deals()
+        series = list(iter_series(deal_rows(deals), self.series_state))
+        if series:
+            for account in self.accounts:
+                account.add(series)
+        return series
+
+
+async def render_dirty(accounts, output_dir):
+    for account in accounts:
+        if account.dirty and account.weekly.base_time is not None:
+            account.dirty = False
+            output_file = os.path.join(output_dir, f'{account.label}_live.png')
+            await asyncio.to_thread(draw_weekly_balance, account.weekly.as_weekly(), output_file)
+
+
+async def watch(file_name, accounts, interval=1.0, plot_interval=30.0, output_dir='files', stop=None):
+    # Polls the file every `interval` seconds; plots are redrawn in a thread at most every `plot_interval` seconds
+    session = LiveSession(file_name, accounts)
+    loop = asyncio.get_running_loop()
+    next_plot = loop.time()
+    while stop is None or not stop.is_set():
+        series = session.update()
+        if series:
+            print(f'{format_time(series[-1].time)}: новых серий {len(series)}')
+            for account in accounts:
+                print('  ' + account.status())
+        if loop.time() >= next_plot:
+            await render_dirty(accounts, output_dir)
+            next_plot = loop.time() + plot_interval
+        await asyncio.sleep(interval)
+    await render_dirty(accounts, output_dir)
+    return session
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Отслеживание отчета или CSV со сделками по мере записи')
+    parser.add_argument('source', help='HTML отчет тестера или CSV выгрузка сделок')
+    parser.add_argument('--initial-balances', default='1000')
+    parser.add_argument('--drawdown-levels', default='9')
+    parser.add_argument('--interval', type=float, default=1.0, help='Период опроса файла, секунды')
+    parser.add_argument('--plot-interval', type=float, default=30.0, help='Не чаще одного графика за столько секунд')
+    parser.add_argument('--output-dir', default='files')
+    args = parser.parse_args()
+
+    accounts = []
+    for initial_balance in args.initial_balances.split(','):
+        for drawdown_level in args.drawdown_levels.split(','):
+            label = f'{int(drawdown_level):02d}_{initial_balance}'
+            accounts.append(LiveAccount(label, int(initial_balance), int(drawdown_level), None, RISK_MANAGE, PROFIT_MINING))
+    try:
+        asyncio.run(watch(args.source, accounts, args.interval, args.plot_interval, args.output_dir))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
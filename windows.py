@@ -0,0 +1,194 @@
+import argparse
+import numpy as np
+import pandas as pd
+
+from deal_cache import load_deal_columns
+from deal_series import SeriesTable
+from balance_engine import date_window, deal_losses, recalculate_slice, summarize_result
+from timestamps import date_to_epoch
+from main_calculator import RISK_MANAGE, PROFIT_MINING
+
+
+# Windows are (start, end) epoch seconds with both ends included, the same convention as
+# start_date / end_date of recalculate_balance. Calendar windows end one second before the next period.
+
+
+class TimeIndex:
+    # Sorted deal times; every window is resolved to a [left, right) slice with two binary searches
+    __slots__ = ('times',)
+
+    def __init__(self, times):
+        times = np.asarray(times, dtype=np.int64)
+        if len(times) > 1 and np.any(times[1:] < times[:-1]):
+            raise ValueError('Deal times must be sorted')
+        self.times = times
+
+    def __len__(self):
+        return len(self.times)
+
+    def bounds(self, start=None, end=None):
+        return date_window(self.times, start, end)
+
+    def slice(self, start=None, end=None):
+        return slice(*self.bounds(start, end))
+
+    def bulk_bounds(self, starts, ends):
+        # All windows at once: one vectorized searchsorted per side
+        lefts = np.searchsorted(self.times, np.asarray(starts, dtype=np.int64), side='left')
+        rights = np.searchsorted(self.times, np.asarray(ends, dtype=np.int64), side='right')
+        return lefts, np.maximum(lefts, rights)
+
+
+def month_number(epoch):
+    # Months since 1970-01
+    return int(np.int64(epoch).astype('datetime64[s]').astype('datetime64[M]').astype(np.int64))
+
+
+def month_start(months):
+    return np.asarray(months, dtype=np.int64).astype('datetime64[M]').astype('datetime64[s]').astype(np.int64)
+
+
+def history_months(times, start_date=None, end_date=None):
+    first = date_to_epoch(start_date) if start_date is not None else int(times[0])
+    last = date_to_epoch(end_date) if end_date is not None else int(times[-1])
+    return month_number(first), month_number(last)
+
+
+def rolling_windows(times, months=12, step=1, start_date=None, end_date=None):
+    # Calendar-aligned windows of `months` months moved by `step` months; only windows that fit into the history
+    first, last = history_months(times, start_date, end_date)
+    starts = np.arange(first, last - months + 2, step, dtype=np.int64)
+    return list(zip(month_start(starts).tolist(), (month_start(starts + months) - 1).tolist()))
+
+
+def yearly_windows(times, start_date=None, end_date=None):
+    # Calendar years touched by the history, the first and last ones may be partial
+    first, last = history_months(times, start_date, end_date)
+    years = np.arange(first // 12, last // 12 + 1, dtype=np.int64)
+    return list(zip(month_start(years * 12).tolist(), (month_start(years * 12 + 12) - 1).tolist()))
+
+
+def walk_forward_windows(times, train_months=24, test_months=6, step=None, anchored=False, start_date=None, end_date=None):
+    # (train_start, train_end, test_start, test_end): the test period directly follows its training period;
+    # anchored=True keeps every training period starting at the beginning of the history
+    first, last = history_months(times, start_date, end_date)
+    step = step or test_months
+    folds = []
+    for train_start in range(first, last - train_months - test_months + 2, step):
+        test_start = train_start + train_months
+        fold_start = first if anchored else train_start
+        folds.append((int(month_start(fold_start)), int(month_start(test_start) - 1),
+                      int(month_start(test_start)), int(month_start(test_start + test_months) - 1)))
+    return folds
+
+
+class WindowEvaluator:
+    # Evaluates windows over one set of deal arrays. Windows are slices (views) of the shared arrays;
+    # per-deal losses are computed once per drawdown_level for the whole history and sliced per window.
+    def __init__(self, arrays, use_jit=None):
+        self.arrays = arrays
+        self.index = TimeIndex(arrays['times'])
+        self.use_jit = use_jit
+        self.losses = {}
+
+    def level_losses(self, drawdown_level):
+        if drawdown_level not in self.losses:
+            self.losses[drawdown_level] = deal_losses(self.arrays, drawdown_level)
+        return self.losses[drawdown_level]
+
+    def run(self, left, right, initial_balance, drawdown_level, multiplier=None, risk_manage=None, profit_mining=None):
+        multiplier = initial_balance if multiplier is None else multiplier
+        return recalculate_slice(self.arrays, left, right, initial_balance, drawdown_level, multiplier, risk_manage, profit_mining,
+                                 self.use_jit, self.level_losses(drawdown_level))
+
+    def summarize(self, left, right, initial_balance, drawdown_level, multiplier=None, risk_manage=None, profit_mining=None):
+        result = self.run(left, right, initial_balance, drawdown_level, multiplier, risk_manage, profit_mining)
+        return summarize_result(result, initial_balance)
+
+    def evaluate(self, windows, initial_balance, drawdown_level, multiplier=None, risk_manage=None, profit_mining=None, labels=None):
+        # One summary row per (start, end) window; labels are extra columns of every row, e.g. the parameter set
+        windows = list(windows)
+        starts = [window[0] for window in windows]
+        ends = [window[1] for window in windows]
+        lefts, rights = self.index.bulk_bounds(starts, ends)
+        rows = []
+        for start, end, left, right in zip(starts, ends, lefts.tolist(), rights.tolist()):
+            row = {'start': start, 'end': end, **(labels or {})}
+            row.update(self.summarize(left, right, initial_balance, drawdown_level, multiplier, risk_manage, profit_mining))
+            rows.append(row)
+        return window_frame(rows)
+
+    def walk_forward(self, folds, grid, objective='final_balance', ascending=False):
+        # For every fold the best parameter set of the training period (sweep.param_grid rows) is run on the test period
+        folds = list(folds)
+        train_lefts, train_rights = self.index.bulk_bounds([fold[0] for fold in folds], [fold[1] for fold in folds])
+        test_lefts, test_rights = self.index.bulk_bounds([fold[2] for fold in folds], [fold[3] for fold in folds])
+        sign = 1 if ascending else -1
+
+        rows = []
+        for fold, train_left, train_right, test_left, test_right in zip(folds, train_lefts.tolist(), train_rights.tolist(),
+                                                                       test_lefts.tolist(), test_rights.tolist()):
+            best, best_value = None, None
+            for params in grid:
+                summary = self.summarize(train_left, train_right, params['initial_balance'], params['drawdown_level'],
+                                         params['multiplier'], params['risk_manage_tiers'], params['profit_mining_tiers'])
+                value = summary[objective]
+                if value is not None and (best_value is None or sign * value < sign * best_value):
+                    best, best_value = params, value
+            if best is None:
+                continue
+
+            row = {'train_start': fold[0], 'train_end': fold[1], 'start': fold[2], 'end': fold[3]}
+            row.update({key: value for key, value in best.items() if not key.endswith('_tiers')})
+            row[f'train_{objective}'] = best_value
+            row.update(self.summarize(test_left, test_right, best['initial_balance'], best['drawdown_level'],
+                                      best['multiplier'], best['risk_manage_tiers'], best['profit_mining_tiers']))
+            rows.append(row)
+        return window_frame(rows)
+
+
+def window_frame(rows):
+    # Epoch window bounds become datetime columns for reading
+    table = pd.DataFrame(rows)
+    for column in ('train_start', 'train_end', 'start', 'end'):
+        if column in table:
+            table[column] = table[column].to_numpy(dtype=np.int64).astype('datetime64[s]')
+    return table
+
+
+def main():
+    from sweep import param_grid, parse_values
+
+    parser = argparse.ArgumentParser(description='Расчет баланса по скользящим окнам и walk-forward')
+    parser.add_argument('report', help='HTML отчет тестера MT5')
+    parser.add_argument('--initial-balances', default='1000')
+    parser.add_argument('--drawdown-levels', default='9')
+    parser.add_argument('--months', type=int, default=12, help='Длина скользящего окна в месяцах')
+    parser.add_argument('--step', type=int, default=1, help='Шаг окна в месяцах')
+    parser.add_argument('--yearly', action='store_true', help='Календарные годы вместо скользящих окон')
+    parser.add_argument('--walk-forward', metavar='TRAIN,TEST', help='Walk-forward: месяцы обучения и проверки')
+    parser.add_argument('--anchored', action='store_true')
+    parser.add_argument('--objective', default='final_balance')
+    args = parser.parse_args()
+
+    arrays = SeriesTable.from_columns(load_deal_columns(args.report)).arrays()
+    evaluator = WindowEvaluator(arrays)
+    grid = param_grid(parse_values(args.initial_balances), parse_values(args.drawdown_levels), {'base': RISK_MANAGE}, {'base': PROFIT_MINING})
+
+    if args.walk_forward:
+        train_months, test_months = (int(value) for value in args.walk_forward.split(','))
+        folds = walk_forward_windows(arrays['times'], train_months, test_months, anchored=args.anchored)
+        table = evaluator.walk_forward(folds, grid, args.objective)
+    else:
+        windows = yearly_windows(arrays['times']) if args.yearly else rolling_windows(arrays['times'], args.months, args.step)
+        tables = []
+        for params in grid:
+            labels = {key: value for key, value in params.items() if not key.endswith('_tiers')}
+            tables.append(evaluator.evaluate(windows, params['initial_balance'], params['drawdown_level'], params['multiplier'],
+                                             params['risk_manage_tiers'], params['profit_mining_tiers'], labels))
+        table = pd.concat(tables, ignore_index=True)
+    print(table.to_string())
+
+
+if __name__ == '__main__':
+    main()